@@ -1,22 +1,35 @@
 import os
-from concurrent.futures.thread import ThreadPoolExecutor
 from functools import partial
 
+import aiohttp
 import aioredis
 from aiohttp import web
 from aiojobs import create_scheduler
 
+from api.auth.limits import init_login_limiter
+from api.auth.passwords import init_passwords, close_passwords
+from api.auth.users import init_users, close_users
+from api.cache import ocr_cache
 from api.db.db import init_pg, close_pg
+from api.db.writer import init_writer, close_writer
+from api.dispatcher import init_dispatcher, close_dispatcher
+from api.jobs import jobs
+from api.metrics import metrics, start_metrics
 from api.middlewares.jwt_auth import jwt_auth_middleware
+from api.ocr import create_ocr_executor
+from api.processed import init_processed_index
+from api.queue import queue
+from api.tracing import tracer
 from utils.common import init_config
+from utils.profiling import init_profiling
 from .routes import init_routes
 
 templates_path = os.path.join(os.path.dirname(__file__), 'templates')
 
 
 async def redis(app: web.Application) -> None:
-    """A function that, when the server is started, connects to redis,
-    and after stopping it breaks the connection (after yield)
+    """A function that, when the server is started, creates pool of redis connections
+    shared by handlers and background tasks, and after stopping closes it (after yield)
 
     :param app:
     :return:
@@ -24,8 +37,10 @@ async def redis(app: web.Application) -> None:
     config = app['config']['redis']
 
     create_redis = partial(
-        aioredis.create_redis,
-        f'redis://{config["host"]}:{config["port"]}'
+        aioredis.create_redis_pool,
+        f'redis://{config["host"]}:{config["port"]}',
+        minsize=config['min_size'],
+        maxsize=config['max_size'],
     )
     app['create_redis'] = await create_redis()
 
@@ -35,16 +50,41 @@ async def redis(app: web.Application) -> None:
     await app['create_redis'].wait_closed()
 
 
+async def http_client(app: web.Application) -> None:
+    """A function that, when the server is started, creates shared HTTP client
+    session for image downloads, and after stopping closes it (after yield)
+
+    :param app:
+    :return:
+    """
+    config = app['config']['http']
+
+    connector = aiohttp.TCPConnector(
+        ssl=False,
+        limit=config['limit'],
+        limit_per_host=config['limit_per_host'],
+        use_dns_cache=True,
+        ttl_dns_cache=config['dns_cache_ttl'],
+        keepalive_timeout=config['keepalive_timeout'],
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config['total_timeout'],
+        connect=config['connect_timeout'],
+    )
+    app['http_session'] = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    yield
+
+    await app['http_session'].close()
+
+
 async def init_executor(app: web.Application) -> web.Application:
-    """ Initialize ThreadPoolExecutor for running blocking tasks
+    """ Initialize pool of OCR worker processes for running blocking tasks
 
     :param app: Web application
     :return: Web application
     """
-    workers = app['config']['app']['workers']
-
-    app['tasks'] = []
-    app['executor'] = ThreadPoolExecutor(max_workers=workers)
+    app['executor'] = create_ocr_executor(app['config']['ocr'])
 
     return app
 
@@ -55,9 +95,6 @@ async def close_executor(app: web.Application) -> web.Application:
     :param app: Web application
     :return: Web application
     """
-    for task in app['tasks']:
-        task.close()
-
     app['executor'].shutdown()
 
     return app
@@ -69,8 +106,12 @@ async def init_aiojobs(app: web.Application) -> web.Application:
     :param app: Web application
     :return: Web application
     """
+    config = app['config']['dispatcher']
 
-    app['AIOJOBS_SCHEDULER'] = await create_scheduler()
+    app['AIOJOBS_SCHEDULER'] = await create_scheduler(
+        limit=config['concurrency'],
+        pending_limit=config['pending_limit'],
+    )
 
     return app
 
@@ -86,31 +127,63 @@ async def close_aiojobs(app: web.Application) -> web.Application:
     return app
 
 
-def init_app(config=None) -> web.Application:
-    """ Initialize application
+def init_processing(app: web.Application, dispatch: bool) -> None:
+    """ Register startup and cleanup of connections and processing pipeline
 
-    :param config:
+    :param app: Web application
+    :param dispatch: Run background dispatcher that drains the work queue
     :return:
     """
-    app = web.Application(middlewares=[jwt_auth_middleware])
-
-    init_config(app, config)
-
     # create db connection on startup, shutdown on exit
     app.on_startup.append(init_pg)
+    app.on_startup.append(init_processed_index)
+    app.on_startup.append(init_writer)
     app.on_startup.append(init_executor)
     app.on_startup.append(init_aiojobs)
+    app.on_startup.append(start_metrics)
+
+    # stop jobs and drain buffered results while db and redis are still connected
+    if dispatch:
+        app.on_startup.append(init_dispatcher)
+        app.on_shutdown.append(close_dispatcher)
+    app.on_shutdown.append(close_aiojobs)
+    app.on_shutdown.append(close_writer)
 
     app.on_cleanup.append(close_pg)
     app.on_cleanup.append(close_executor)
-    app.on_cleanup.append(close_aiojobs)
-
 
     app.cleanup_ctx.extend([
         redis,
+        metrics,
+        queue,
+        jobs,
+        ocr_cache,
+        http_client,
+        tracer,
     ])
 
+
+def init_app(config=None) -> web.Application:
+    """ Initialize application
+
+    :param config:
+    :return:
+    """
+    app = web.Application(middlewares=[jwt_auth_middleware])
+
+    init_config(app, config)
+
+    init_processing(app, dispatch=app['config']['dispatcher']['enabled'])
+
+    # cache users for authentication when db is connected
+    app.on_startup.append(init_users)
+    app.on_startup.append(init_passwords)
+    app.on_startup.append(init_login_limiter)
+    app.on_startup.append(init_profiling)
+    app.on_shutdown.append(close_users)
+    app.on_cleanup.append(close_passwords)
+
     # setup views and routes
     init_routes(app)
 
-    return app
\ No newline at end of file
+    return app
@@ -7,8 +7,9 @@ from aiohttp.web_response import json_response
 from aiohttp_apispec import request_schema
 import trafaret as T
 from trafaret import DataError
-from werkzeug.security import generate_password_hash, check_password_hash
 
+from api.auth.limits import client_address
+from api.auth.passwords import HashingOverloaded
 from api.db.tables import users
 from api.schemas import UserLoginSchema, UserRegisterSchema
 from api.validators.auth import LOGIN_TRAFARET, REGISTER_TRAFARET
@@ -16,12 +17,15 @@ from api.validators.auth import LOGIN_TRAFARET, REGISTER_TRAFARET
 
 @request_schema(UserLoginSchema)
 async def login_user(request: web.Request) -> web.Response:
-    """ Login user handler. Check if user exist in database and generate JWT token
+    """ Login user handler. Check if user exist in database and generate JWT token.
+    Password is rehashed if hashing settings were changed since it was stored.
 
     :param request: web request
-    :return: web response in json format
+    :return: web response in json format, 429 if there are too many attempts
+        or 503 if passwords hashing is overloaded
     """
     jwt_config = request.app['config']['jwt_auth']
+    passwords = request.app['passwords']
     json_data = await request.json()
 
     result = T.catch_error(LOGIN_TRAFARET, json_data)
@@ -29,28 +33,50 @@ async def login_user(request: web.Request) -> web.Response:
         errors = result.as_dict()
         return json_response({'errors': errors}, status=400)
 
+    retry_after = await request.app['login_limiter'].hit(json_data['email'],
+                                                        client_address(request))
+    if retry_after:
+        return json_response({'message': 'Too many login attempts'}, status=429,
+                             headers={'Retry-After': str(retry_after)})
+
+    # connection is not held while password is hashed
     async with request.app['db'].acquire() as connection:
         cursor = await connection.execute(
             users.select()
                 .where(users.c.email == json_data['email'])
         )
         user_credentials = await cursor.fetchone()
-        if not user_credentials:
-            return json_response({
-                'message': 'User with email {email} does not exist'.format(email=json_data['email'])
-            }, status=403)
-        else:
-            id, email, password = user_credentials['id'], user_credentials['email'], user_credentials['password']
-            if check_password_hash(password, json_data['password']):
-                payload = {
-                    'user_id': id,
-                    'user_email': email,
-                    'exp': datetime.datetime.utcnow() + timedelta(seconds=jwt_config['jset_exp_delta_seconds'])
-                }
-                jwt_token = jwt.encode(payload, jwt_config['jwt_secret'], jwt_config['jwt_algorithm'])
-                return json_response({'token': jwt_token.decode('utf-8')})
-            else:
-                return json_response({'message': 'Password is not correct'}, status=401)
+
+    if not user_credentials:
+        return json_response({
+            'message': 'User with email {email} does not exist'.format(email=json_data['email'])
+        }, status=403)
+
+    id, email, password = user_credentials['id'], user_credentials['email'], user_credentials['password']
+    try:
+        if not await passwords.verify(password, json_data['password']):
+            return json_response({'message': 'Password is not correct'}, status=401)
+
+        if passwords.needs_rehash(password):
+            new_password = await passwords.hash(json_data['password'])
+            async with request.app['db'].acquire() as connection:
+                await connection.execute(
+                    users.update()
+                        .where(users.c.id == id)
+                        .values(password=new_password)
+                )
+            await request.app['users'].invalidate(id)
+    except HashingOverloaded:
+        return json_response({'message': 'Service is overloaded, retry later'}, status=503,
+                             headers={'Retry-After': '1'})
+
+    payload = {
+        'user_id': id,
+        'user_email': email,
+        'exp': datetime.datetime.utcnow() + timedelta(seconds=jwt_config['jset_exp_delta_seconds'])
+    }
+    jwt_token = jwt.encode(payload, jwt_config['jwt_secret'], jwt_config['jwt_algorithm'])
+    return json_response({'token': jwt_token.decode('utf-8')})
 
 
 @request_schema(UserRegisterSchema)
@@ -58,7 +84,7 @@ async def register_user(request: web.Request) -> web.Response:
     """ Register user handler. Check if user already exist or create new user in database
 
     :param request: web request
-    :return: web response in json format
+    :return: web response in json format or 503 if passwords hashing is overloaded
     """
     json_data = await request.json()
     result = T.catch_error(REGISTER_TRAFARET, json_data)
@@ -72,19 +98,27 @@ async def register_user(request: web.Request) -> web.Response:
                 .where(users.c.email == json_data['email'])
         )
         user_credentials = await cursor.fetchone()
-        if user_credentials:
-            return json_response({
-                'message': 'User with email {email} already exist'.format(email=json_data['email'])
-            })
-        else:
-            await connection.execute(
-                users.insert().values(
-                    name=json_data['name'],
-                    last_name=json_data['last_name'],
-                    email=json_data['email'],
-                    password=generate_password_hash(json_data['password']),
-                )
+
+    if user_credentials:
+        return json_response({
+            'message': 'User with email {email} already exist'.format(email=json_data['email'])
+        })
+
+    try:
+        password = await request.app['passwords'].hash(json_data['password'])
+    except HashingOverloaded:
+        return json_response({'message': 'Service is overloaded, retry later'}, status=503,
+                             headers={'Retry-After': '1'})
+
+    async with request.app['db'].acquire() as connection:
+        await connection.execute(
+            users.insert().values(
+                name=json_data['name'],
+                last_name=json_data['last_name'],
+                email=json_data['email'],
+                password=password,
             )
-            return json_response({
-                'message': 'User with email {email} register successfully'.format(email=json_data['email'])
-            })
+        )
+    return json_response({
+        'message': 'User with email {email} register successfully'.format(email=json_data['email'])
+    })
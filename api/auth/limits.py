@@ -0,0 +1,78 @@
+from typing import Optional
+
+import aioredis
+from aiohttp import web
+
+# Count attempt in fixed window that starts with the first attempt
+HIT_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+if count > tonumber(ARGV[2]) then
+    return redis.call('TTL', KEYS[1])
+end
+return 0
+"""
+
+
+class LoginLimiter:
+    """ Limits login attempts per email and per client address in fixed time window,
+    so login bursts can not take all password hashing capacity
+    """
+
+    def __init__(self, redis: aioredis.Redis, prefix: str, window: int, per_email: int,
+                 per_address: int):
+        self.redis = redis
+        self.prefix = prefix
+        self.window = window
+        self.limits = {'email': per_email, 'address': per_address}
+
+    def key(self, kind: str, value: str) -> str:
+        return '{prefix}:{kind}:{value}'.format(prefix=self.prefix, kind=kind, value=value)
+
+    async def hit(self, email: str, address: str) -> Optional[int]:
+        """ Count login attempt
+
+        :param email: Email of user
+        :param address: Client address
+        :return: Seconds until next attempt is allowed if limit is exceeded else None
+        """
+        for kind, value in (('email', email.lower()), ('address', address)):
+            limit = self.limits[kind]
+            if not limit:
+                continue
+            retry_after = await self.redis.eval(
+                HIT_SCRIPT, keys=[self.key(kind, value)], args=[self.window, limit]
+            )
+            if retry_after:
+                return max(retry_after, 1)
+        return None
+
+
+def client_address(request: web.Request) -> str:
+    """ Address of client, nginx passes it in X-Real-IP header
+
+    :param request: web request
+    :return: Client address
+    """
+    return request.headers.get('X-Real-IP') or request.remote or 'unknown'
+
+
+async def init_login_limiter(app: web.Application) -> web.Application:
+    """ Initialize limiter of login attempts
+
+    :param app: Web application
+    :return: Web application
+    """
+    config = app['config']['login_limit']
+
+    app['login_limiter'] = LoginLimiter(
+        app['create_redis'],
+        prefix=config['prefix'],
+        window=config['window'],
+        per_email=config['per_email'],
+        per_address=config['per_address'],
+    )
+
+    return app
@@ -0,0 +1,94 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingOverloaded(Exception):
+    """ Too many passwords are waiting for hashing """
+
+
+class PasswordHasher:
+    """ Hashes and checks passwords in dedicated bounded thread pool, so CPU-expensive
+    hashing does not block the event loop. PBKDF2 of hashlib releases GIL while hashing.
+
+    At most ``workers`` passwords are hashed at once and ``queue_size`` wait,
+    others are rejected at once with ``HashingOverloaded``.
+    """
+
+    def __init__(self, method: str, iterations: int, salt_length: int, workers: int,
+                 queue_size: int):
+        self.method = '{method}:{iterations}'.format(method=method, iterations=iterations)
+        self.salt_length = salt_length
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='password-hashing')
+        self.semaphore = asyncio.Semaphore(workers + queue_size)
+
+    async def hash(self, password: str) -> str:
+        """ Hash password with current method and cost
+
+        :param password: Password
+        :return: Password hash
+        """
+        return await self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    async def verify(self, password_hash: str, password: str) -> bool:
+        """ Check password against hash
+
+        :param password_hash: Stored password hash
+        :param password: Password
+        :return: True if password is correct
+        """
+        return await self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """ Check if hash was made with other method, cost or salt length
+
+        :param password_hash: Stored password hash
+        :return: True if password should be hashed again
+        """
+        method, _, rest = password_hash.partition('$')
+        salt, _, _ = rest.partition('$')
+        return method != self.method or len(salt) != self.salt_length
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    async def _run(self, func, *args):
+        if self.semaphore.locked():
+            raise HashingOverloaded()
+
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+
+async def init_passwords(app: web.Application) -> web.Application:
+    """ Initialize password hasher
+
+    :param app: Web application
+    :return: Web application
+    """
+    config = app['config']['passwords']
+
+    app['passwords'] = PasswordHasher(
+        method=config['method'],
+        iterations=config['iterations'],
+        salt_length=config['salt_length'],
+        workers=config['workers'],
+        queue_size=config['queue_size'],
+    )
+
+    return app
+
+
+async def close_passwords(app: web.Application) -> web.Application:
+    """ Shutdown hashing thread pool
+
+    :param app: Web application
+    :return: Web application
+    """
+    app['passwords'].close()
+
+    return app
@@ -0,0 +1,151 @@
+import asyncio
+from typing import Optional
+
+import aioredis
+from aiohttp import web
+from aiopg.sa import Engine
+
+from api.db.tables import users
+from utils.cache import LRUCache
+from utils.logging import create_logger
+
+logger = create_logger(__name__)
+
+# Password hash is not needed to authenticate requests and is not kept in memory
+USER_FIELDS = (users.c.id, users.c.name, users.c.last_name, users.c.email)
+
+
+class UserCache:
+    """ Bounded TTL cache of user records for request authentication.
+
+    Changed users are invalidated in all processes with Redis pub/sub,
+    TTL limits staleness if invalidation message was missed.
+    """
+
+    def __init__(self, engine: Engine, redis: aioredis.Redis, channel: str, maxsize: int,
+                 ttl: float):
+        self.engine = engine
+        self.redis = redis
+        self.channel = channel
+        self.local = LRUCache(maxsize, ttl)
+        self._loading = {}
+        # changed on every invalidation, so record loaded before it is not cached
+        self._version = 0
+        self._listener = None
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        """ Get user record, concurrent requests of not cached user share one query
+
+        :param user_id: User id
+        :return: User record or None if user does not exist
+        """
+        user = self.local.get(user_id)
+        if user is not None:
+            return user
+
+        if user_id not in self._loading:
+            self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+        return await asyncio.shield(self._loading[user_id])
+
+    async def invalidate(self, user_id: int) -> None:
+        """ Drop user record in all processes
+
+        :param user_id: User id
+        :return:
+        """
+        self._drop(user_id)
+        await self.redis.publish(self.channel, str(user_id))
+
+    def start_listening(self, address: str) -> None:
+        self._listener = asyncio.ensure_future(self._listen(address))
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+
+    def _drop(self, user_id: Optional[int] = None) -> None:
+        self._version += 1
+        if user_id is None:
+            self.local.clear()
+        else:
+            self.local.pop(user_id)
+
+    async def _load(self, user_id: int) -> Optional[dict]:
+        version = self._version
+        try:
+            async with self.engine.acquire() as connection:
+                cursor = await connection.execute(
+                    users.select().with_only_columns(USER_FIELDS).where(users.c.id == user_id)
+                )
+                row = await cursor.fetchone()
+        finally:
+            del self._loading[user_id]
+
+        if row is None:
+            return None
+
+        user = dict(row)
+        if version == self._version:
+            self.local.set(user_id, user)
+        return user
+
+    async def _listen(self, address: str) -> None:
+        """ Receive invalidations on dedicated connection, subscribed connection
+        can not be shared with other commands
+
+        :param address: Redis address
+        :return:
+        """
+        while True:
+            subscriber = None
+            try:
+                subscriber = await aioredis.create_redis(address)
+                channel, = await subscriber.subscribe(self.channel)
+                # invalidations could be missed while not subscribed
+                self._drop()
+
+                while await channel.wait_message():
+                    user_id = await channel.get(encoding='utf-8')
+                    self._drop(int(user_id))
+            except (aioredis.RedisError, OSError):
+                logger.exception('User invalidation channel is disconnected')
+            finally:
+                if subscriber is not None:
+                    subscriber.close()
+                    await subscriber.wait_closed()
+
+            self._drop()
+            await asyncio.sleep(1)
+
+
+async def init_users(app: web.Application) -> web.Application:
+    """ Initialize cache of users and start receiving invalidations
+
+    :param app: Web application
+    :return: Web application
+    """
+    config = app['config']['users']
+    redis = app['config']['redis']
+
+    app['users'] = UserCache(
+        app['db'],
+        app['create_redis'],
+        channel=config['channel'],
+        maxsize=config['cache_size'],
+        ttl=config['cache_ttl'],
+    )
+    app['users'].start_listening(f'redis://{redis["host"]}:{redis["port"]}')
+
+    return app
+
+
+async def close_users(app: web.Application) -> web.Application:
+    """ Stop receiving invalidations
+
+    :param app: Web application
+    :return: Web application
+    """
+    await app['users'].close()
+
+    return app
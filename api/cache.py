@@ -0,0 +1,125 @@
+import hashlib
+import time
+from typing import Optional
+
+import aioredis
+import ujson
+from aiohttp import web
+
+from api.metrics import OCR_CACHE_LOOKUPS, REDIS_COMMAND_SECONDS
+from api.ocr import engine_settings
+from utils.cache import LRUCache
+
+
+class OCRCache:
+    """ Content-addressed cache of recognition results.
+
+    Key is a hash of image bytes and OCR settings. Lookups go to bounded
+    in-process LRU first and then to Redis, where entries expire after ``ttl``
+    and the least recently stored entries are evicted over ``max_entries``.
+    """
+
+    def __init__(self, redis: aioredis.Redis, prefix: str, settings: dict, local_size: int,
+                 ttl: int, max_entries: int):
+        self.redis = redis
+        self.prefix = prefix
+        self.index = '{prefix}:index'.format(prefix=prefix)
+        self.settings = settings
+        self.local = LRUCache(local_size)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0}
+
+    def key(self, body: bytes, settings: dict = None) -> str:
+        """ Build cache key for image body
+
+        :param body: Image bytes body
+        :param settings: OCR settings that override default ones
+        :return: Cache key
+        """
+        digest = hashlib.blake2b(body, digest_size=20)
+        digest.update(ujson.dumps(dict(self.settings, **(settings or {})), sort_keys=True).encode())
+        return '{prefix}:{digest}'.format(prefix=self.prefix, digest=digest.hexdigest())
+
+    async def get(self, key: str) -> Optional[dict]:
+        """ Get recognition result by cache key
+
+        :param key: Cache key
+        :return: Recognition result or None if key is not cached
+        """
+        result = self.local.get(key)
+        if result is not None:
+            self.stats['local_hits'] += 1
+            OCR_CACHE_LOOKUPS.inc(result='local_hit')
+            return result
+
+        with REDIS_COMMAND_SECONDS.time(command='cache_get'):
+            value = await self.redis.get(key)
+        if value is not None:
+            self.stats['redis_hits'] += 1
+            OCR_CACHE_LOOKUPS.inc(result='redis_hit')
+            result = ujson.loads(value)
+            self.local.set(key, result)
+            return result
+
+        self.stats['misses'] += 1
+        OCR_CACHE_LOOKUPS.inc(result='miss')
+        return None
+
+    async def set(self, key: str, result: dict) -> None:
+        """ Store recognition result in both cache tiers
+
+        :param key: Cache key
+        :param result: Recognition result
+        :return:
+        """
+        self.local.set(key, result)
+
+        now = time.time()
+        transaction = self.redis.multi_exec()
+        transaction.set(key, ujson.dumps(result), expire=self.ttl)
+        transaction.zadd(self.index, now, key)
+        transaction.zremrangebyscore(self.index, max=now - self.ttl)
+        transaction.zcard(self.index)
+        *_, size = await transaction.execute()
+
+        if size > self.max_entries:
+            evicted = await self.redis.zpopmin(self.index, size - self.max_entries)
+            # zpopmin returns flat list with members and scores
+            if evicted:
+                await self.redis.delete(*evicted[::2])
+
+    def info(self) -> dict:
+        """ Get cache statistics
+
+        :return: Dict with hit/miss counters and local tier size
+        """
+        lookups = sum(self.stats.values())
+        hits = self.stats['local_hits'] + self.stats['redis_hits']
+
+        return dict(
+            self.stats,
+            local_size=len(self.local),
+            hit_ratio=round(hits / lookups, 4) if lookups else 0,
+        )
+
+
+async def ocr_cache(app: web.Application) -> None:
+    """ Create OCR result cache on top of redis connection
+
+    :param app: Web application
+    :return:
+    """
+    config = app['config']['ocr_cache']
+    settings = engine_settings(app['config']['ocr'])
+
+    app['ocr_cache'] = OCRCache(
+        app['create_redis'],
+        prefix=config['prefix'],
+        settings=settings,
+        local_size=config['local_size'],
+        ttl=config['ttl'],
+        max_entries=config['max_entries'],
+    )
+
+    yield
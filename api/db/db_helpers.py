@@ -1,64 +1,188 @@
+import base64
+import binascii
+from datetime import datetime
+
 import aiopg
 import sqlalchemy
 from aiohttp import web
+from sqlalchemy.dialects import postgresql
 
-from api.db.tables import images
+from api.db.tables import images, image_texts
 
+# Value of image_url column for products without found text
+NOT_FOUND_URL = 'n/a'
 
-async def check_exist(connection: aiopg.connection, table: sqlalchemy.table,
-                      column: sqlalchemy.column, value:str) -> bool:
-    """ Function that check if specific value exist in db
 
-    :param connection: Current connection to db
-    :param table: Table where the value will search
-    :param column: Column where the value will search
-    :param value: Value for searching
-    :return: True if value exist in db, otherwise - False
+def encode_cursor(row_id: int) -> str:
+    """ Encode id of the last row on page to opaque pagination token
+
+    :param row_id: Row id
+    :return: Pagination token
     """
-    result = await connection.execute(
-        table.select()
-            .where(table.c[column] == value)
-    )
-    row = await result.fetchone()
-    if row:
-        if dict(row).get(column, '') == value:
-            return True
-        else:
-            return False
-    else:
-        return False
+    return base64.urlsafe_b64encode(str(row_id).encode()).decode()
+
+
+def decode_cursor(token: str) -> int:
+    """ Decode pagination token
+
+    :param token: Pagination token
+    :return: Row id
+    :raise ValueError: If token is not valid
+    """
+    try:
+        return int(base64.urlsafe_b64decode(token.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(e)
 
 
-async def get_result_from_db(request: web.Request, limit, offset):
-    """ Get processing results from DB with offset and limit
+async def get_result_from_db(request: web.Request, limit: int, after: int = None,
+                             offset: int = 0) -> tuple:
+    """ Get processing results from DB. Pages are selected by id of the last row
+    on previous page if ``after`` is passed, otherwise with offset.
 
     :param request:  web request
     :param limit: Count rows from db
+    :param after: Id of the last row on previous page
     :param offset: Count rows from db need to skip
-    :return: List with records from db
+    :return: List with records from db and pagination token of next page
     """
+    user_id = request['user']['id']
+
+    query = (
+        sqlalchemy.select([images.c.id, images.c.product_id, images.c.image_url, images.c.image_text,
+                           images.c.phrases])
+            .where(images.c.user_id == user_id)
+            .order_by(images.c.id)
+            .limit(limit)
+    )
+
+    if after is not None:
+        query = query.where(images.c.id > after)
+    elif offset:
+        query = query.offset(offset)
+
     results = []
     async with request.app['db'].acquire() as connection:
-        sql_query = """
-            SELECT 
-                product_id, image_url, image_text 
-            FROM 
-                images
-            WHERE user_id = {user_id}
-                LIMIT {limit} OFFSET {offset};
-        """.format(
-            limit=limit,
-            offset=offset,
-            user_id=request.app['user']['id']
-        )
+        async for row in connection.execute(query):
+            results.append(dict(row))
+
+    next_token = encode_cursor(results[-1]['id']) if len(results) == limit else None
+    for row in results:
+        del row['id']
+
+    return results, next_token
+
+
+async def search_texts(request: web.Request, phrase: str, limit: int, after: int = None) -> tuple:
+    """ Find images of user with phrase in recognized text using full-text index
 
-        async for row in connection.execute(sql_query):
+    :param request: web request
+    :param phrase: Searched phrase, words must follow each other
+    :param limit: Count rows from db
+    :param after: Id of the last row on previous page
+    :return: List with found images and pagination token of next page
+    """
+    query = (
+        sqlalchemy.select([image_texts.c.id, image_texts.c.product_id, image_texts.c.image_url,
+                           image_texts.c.confidence])
+            .where(image_texts.c.user_id == request['user']['id'])
+            .where(image_texts.c.search.op('@@')(
+                sqlalchemy.func.phraseto_tsquery('simple', phrase)))
+            .order_by(image_texts.c.id)
+            .limit(limit)
+    )
+    if after is not None:
+        query = query.where(image_texts.c.id > after)
+
+    results = []
+    async with request.app['db'].acquire() as connection:
+        async for row in connection.execute(query):
             results.append(dict(row))
 
-        query = await connection.execute(
-            images.select()
-                .where(images.c.user_id == request.app['user']['id'])
+    next_token = encode_cursor(results[-1]['id']) if len(results) == limit else None
+    for row in results:
+        del row['id']
+
+    return results, next_token
+
+
+async def get_result_count(request: web.Request, exact: bool = False) -> int:
+    """ Get count of user results. Count is cached in Redis for ``count_ttl`` seconds.
+
+    :param request: web request
+    :param exact: Skip cached value
+    :return: Count of rows
+    """
+    redis = request.app['create_redis']
+    user_id = request['user']['id']
+    cache_key = 'results:count:{user_id}'.format(user_id=user_id)
+
+    if not exact:
+        count = await redis.get(cache_key)
+        if count is not None:
+            return int(count)
+
+    async with request.app['db'].acquire() as connection:
+        count = await connection.scalar(
+            sqlalchemy.select([sqlalchemy.func.count()])
+                .select_from(images)
+                .where(images.c.user_id == user_id)
         )
-        row_count = query.rowcount
 
-    return results, row_count
+    await redis.set(cache_key, count, expire=request.app['config']['results']['count_ttl'])
+
+    return count
+
+
+def export_query(user_id: int, since: datetime = None, until: datetime = None,
+                 found: bool = None) -> sqlalchemy.sql.Select:
+    """ Build query for results export
+
+    :param user_id: User id
+    :param since: Export results processed since this date
+    :param until: Export results processed before this date
+    :param found: Export only found (True) or only not found (False) results
+    :return: Select query
+    """
+    query = (
+        sqlalchemy.select([images.c.product_id, images.c.image_url, images.c.image_text,
+                           images.c.phrases, images.c.created_at])
+            .where(images.c.user_id == user_id)
+            .order_by(images.c.id)
+    )
+
+    if since is not None:
+        query = query.where(images.c.created_at >= since)
+    if until is not None:
+        query = query.where(images.c.created_at < until)
+    if found is True:
+        query = query.where(images.c.image_url != NOT_FOUND_URL)
+    elif found is False:
+        query = query.where(images.c.image_url == NOT_FOUND_URL)
+
+    return query
+
+
+async def iterate_results(connection: aiopg.connection, query: sqlalchemy.sql.Select,
+                          chunk_size: int):
+    """ Read query results in chunks from server-side cursor, so only one chunk
+    is kept in memory. Must be called inside transaction, cursor is closed with it.
+
+    :param connection: Current connection to db
+    :param query: Select query
+    :param chunk_size: Count of rows fetched at once
+    :return: Async generator of lists with rows
+    """
+    compiled = query.compile(dialect=postgresql.dialect())
+    await connection.execute(
+        'DECLARE results_export NO SCROLL CURSOR FOR {query}'.format(query=compiled),
+        compiled.params
+    )
+    while True:
+        cursor = await connection.execute(
+            'FETCH FORWARD {count} FROM results_export'.format(count=int(chunk_size))
+        )
+        rows = await cursor.fetchall()
+        if not rows:
+            break
+        yield rows
@@ -1,8 +1,10 @@
+from alembic import command
+from alembic.config import Config
 from sqlalchemy import create_engine, MetaData
 from werkzeug.security import generate_password_hash
 
-from api.db.tables import users, images
-from utils.common import get_config
+from api.db.tables import users, images, image_texts
+from utils.common import get_config, PROJECT_PATH
 
 DSN = "postgresql://{user}:{password}@{host}:{port}/{database}"
 
@@ -12,13 +14,21 @@ class RecordNotFound(Exception):
 
 
 def create_tables(engine):
+    """ Create current schema, database must be stamped with head revision
+    of migrations after that, see ``stamp_head``
+    """
     meta = MetaData()
-    meta.create_all(bind=engine, tables=[users, images])
+    meta.create_all(bind=engine, tables=[users, images, image_texts])
 
 
 def drop_tables(engine):
     meta = MetaData()
-    meta.drop_all(bind=engine, tables=[users])
+    meta.drop_all(bind=engine, tables=[users, images, image_texts])
+
+
+def stamp_head():
+    """ Mark all migrations as applied to database made by ``create_tables``"""
+    command.stamp(Config((PROJECT_PATH / 'alembic.ini').as_posix()), 'head')
 
 
 def sample_user_data(engine):
@@ -38,3 +48,4 @@ if __name__ == '__main__':
     db_url = DSN.format(**get_config()['postgres'])
     engine = create_engine(db_url)
     create_tables(engine)
+    stamp_head()
@@ -1,5 +1,6 @@
 import sqlalchemy as sa
 from sqlalchemy import MetaData, ForeignKey
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 
 metadata = MetaData()
 
@@ -18,5 +19,25 @@ images = sa.Table(
     sa.Column('product_id', sa.String(20), unique=False, nullable=False),
     sa.Column('image_url', sa.String, nullable=False),
     sa.Column('image_text', sa.String, nullable=False),
-    sa.Column('user_id', sa.Integer, ForeignKey('users.id', ondelete='CASCADE'))
-)
\ No newline at end of file
+    sa.Column('phrases', JSONB, nullable=True),
+    sa.Column('user_id', sa.Integer, ForeignKey('users.id', ondelete='CASCADE')),
+    sa.Column('created_at', sa.DateTime, nullable=False, server_default=sa.func.now()),
+    sa.UniqueConstraint('user_id', 'product_id', name='uq_images_user_id_product_id'),
+    sa.Index('ix_images_user_id_id', 'user_id', 'id'),
+)
+
+image_texts = sa.Table(
+    'image_texts', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('user_id', sa.Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    sa.Column('product_id', sa.String(20), nullable=False),
+    sa.Column('image_url', sa.String, nullable=False),
+    sa.Column('text', sa.Text, nullable=False),
+    sa.Column('words', JSONB, nullable=True),
+    sa.Column('confidence', sa.Float, nullable=True),
+    sa.Column('search', TSVECTOR, sa.Computed("to_tsvector('simple', text)", persisted=True)),
+    sa.Column('created_at', sa.DateTime, nullable=False, server_default=sa.func.now()),
+    sa.UniqueConstraint('user_id', 'product_id', 'image_url',
+                        name='uq_image_texts_user_id_product_id_image_url'),
+    sa.Index('ix_image_texts_search', 'search', postgresql_using='gin'),
+)
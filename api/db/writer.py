@@ -0,0 +1,179 @@
+import asyncio
+
+import sqlalchemy as sa
+from aiohttp import web
+from sqlalchemy.dialects.postgresql import insert
+
+from api.db.tables import images, image_texts
+from api.metrics import DB_WRITE_SECONDS, DB_WRITE_ROWS
+from utils.logging import create_logger
+
+logger = create_logger(__name__)
+
+
+class ResultWriter:
+    """ Write-behind sink for processing results.
+
+    Rows are buffered and flushed as one multi-row upsert when ``batch_size``
+    rows are collected or every ``flush_interval`` seconds, recognized texts
+    of images are stored with them. Callers wait until
+    their row is stored, so queue items are acknowledged only after results
+    are in database.
+    """
+
+    def __init__(self, engine, processed, batch_size: int, flush_interval: float):
+        self.engine = engine
+        self.processed = processed
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = asyncio.Lock()
+        self._flusher = None
+
+    def start(self) -> None:
+        self._flusher = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self) -> None:
+        """ Stop periodic flushing and drain buffered rows
+
+        :return:
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+
+    async def write(self, row: dict, force: bool = False, texts: list = ()) -> None:
+        """ Buffer result row and wait until it is stored
+
+        :param row: Row of images table
+        :param force: Overwrite existing result of the product
+        :param texts: Rows of image_texts table with recognized texts of product images
+        :return:
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((row, force, texts, future))
+
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+
+        await future
+
+    async def flush(self) -> None:
+        """ Store all buffered rows
+
+        :return:
+        """
+        async with self._lock:
+            buffer, self._buffer = self._buffer, []
+            if not buffer:
+                return
+
+            try:
+                await self._store(buffer)
+            except Exception as e:
+                logger.exception('Failed to store {count} results'.format(count=len(buffer)))
+                for *_, future in buffer:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+        for *_, future in buffer:
+            if not future.done():
+                future.set_result(None)
+
+    async def _store(self, buffer: list) -> None:
+        """ Upsert rows, forced rows replace existing results, others are kept
+
+        :param buffer: List with (row, force, texts, future) items
+        :return:
+        """
+        # Upsert can not touch the same row twice, so keep the latest row of every product
+        rows = {}
+        texts = {}
+        for row, force, text_rows, _ in buffer:
+            rows[row['user_id'], row['product_id']] = (row, force)
+            for text_row in text_rows:
+                texts[text_row['user_id'], text_row['product_id'], text_row['image_url']] = text_row
+
+        inserted = [row for row, force in rows.values() if not force]
+        forced = [row for row, force in rows.values() if force]
+
+        with DB_WRITE_SECONDS.time():
+            await self._upsert(inserted, forced, list(texts.values()))
+        DB_WRITE_ROWS.inc(len(rows))
+
+        products = {}
+        for user_id, product_id in rows:
+            products.setdefault(user_id, []).append(product_id)
+        for user_id, product_ids in products.items():
+            await self.processed.add(user_id, *product_ids)
+
+        logger.info('Stored {count} results'.format(count=len(rows)))
+
+    async def _upsert(self, inserted: list, forced: list, texts: list) -> None:
+        async with self.engine.acquire() as connection:
+            if inserted:
+                await connection.execute(
+                    insert(images).values(inserted)
+                        .on_conflict_do_nothing(index_elements=['user_id', 'product_id'])
+                )
+            if forced:
+                query = insert(images).values(forced)
+                await connection.execute(
+                    query.on_conflict_do_update(
+                        index_elements=['user_id', 'product_id'],
+                        set_={
+                            'image_url': query.excluded.image_url,
+                            'image_text': query.excluded.image_text,
+                            'phrases': query.excluded.phrases,
+                            'created_at': sa.func.now(),
+                        }
+                    )
+                )
+            if texts:
+                # texts of the latest recognition replace previous ones
+                query = insert(image_texts).values(texts)
+                await connection.execute(
+                    query.on_conflict_do_update(
+                        index_elements=['user_id', 'product_id', 'image_url'],
+                        set_={
+                            'text': query.excluded.text,
+                            'words': query.excluded.words,
+                            'confidence': query.excluded.confidence,
+                            'created_at': sa.func.now(),
+                        }
+                    )
+                )
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+async def init_writer(app: web.Application) -> web.Application:
+    """ Initialize result writer
+
+    :param app: Web application
+    :return: Web application
+    """
+    config = app['config']['writer']
+
+    app['writer'] = ResultWriter(
+        app['db'], app['processed'], config['batch_size'], config['flush_interval']
+    )
+    app['writer'].start()
+
+    return app
+
+
+async def close_writer(app: web.Application) -> web.Application:
+    """ Drain result writer
+
+    :param app: Web application
+    :return: Web application
+    """
+    await app['writer'].close()
+
+    return app
@@ -0,0 +1,189 @@
+import asyncio
+
+from aiohttp import web
+
+from api.jobs import JobProgress
+from api.metrics import PRODUCTS
+from api.queue import QueueItem, task_user_id
+from api.tasks import async_image_process
+from utils.logging import create_logger
+
+logger = create_logger(__name__)
+
+
+class Dispatcher:
+    """ Background loop that drains the work queue while a job is running.
+
+    Products are claimed in batches only for free scheduler slots, so at most
+    ``concurrency`` products are processed and ``pending_limit`` wait in this process.
+    Processed products are acknowledged in batches: acks collected while previous
+    batch is sent go together in the next one.
+    """
+
+    def __init__(self, app: web.Application, concurrency: int, pending_limit: int,
+                 poll_interval: float, drain_timeout: float):
+        self.app = app
+        self.queue = app['queue']
+        self.jobs = app['jobs']
+        self.processed = app['processed']
+        self.scheduler = app['AIOJOBS_SCHEDULER']
+        self.capacity = concurrency + pending_limit
+        self.poll_interval = poll_interval
+        self.drain_timeout = drain_timeout
+        self._slot_freed = asyncio.Event()
+        self._task = None
+        self._acks = []
+        self._acking = None
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        """ Stop claiming new products and wait up to ``drain_timeout`` seconds
+        until already claimed products are processed
+
+        :return:
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout
+        if len(self.scheduler):
+            logger.info('Wait for {count} products to finish'.format(count=len(self.scheduler)))
+
+        while len(self.scheduler):
+            self._slot_freed.clear()
+            try:
+                await asyncio.wait_for(self._slot_freed.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                logger.info('{count} products were not finished, they will be redelivered'.format(
+                    count=len(self.scheduler)))
+                break
+
+        if self._acking is not None:
+            await self._acking
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.dispatch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Dispatching failed')
+                await asyncio.sleep(self.poll_interval)
+
+    async def dispatch(self) -> None:
+        """ Claim and spawn one batch of products of the running job
+
+        :return:
+        """
+        job_id = await self.jobs.active()
+        if job_id is None:
+            await asyncio.sleep(self.poll_interval)
+            return
+
+        free = self.capacity - len(self.scheduler)
+        if free <= 0:
+            self._slot_freed.clear()
+            await self._slot_freed.wait()
+            return
+
+        items = await self.queue.claim(free)
+        if not items:
+            depth = await self.queue.depth()
+            if not depth['waiting'] and not depth['in_progress']:
+                if await self.jobs.finish(job_id):
+                    logger.info('Job {id} finished'.format(id=job_id))
+            await asyncio.sleep(self.poll_interval)
+            return
+
+        for item in items:
+            progress = JobProgress(self.jobs, job_id, task_user_id(item.key))
+            await self.scheduler.spawn(self.process(item, progress))
+
+    async def process(self, item: QueueItem, progress: JobProgress) -> None:
+        """ Process claimed product and acknowledge it
+
+        :param item: Queue item
+        :param progress: Progress counters of job
+        :return:
+        """
+        try:
+            with progress.stage('processing'):
+                await self._process(item, progress)
+        except asyncio.CancelledError:
+            # Not acknowledged product will be redelivered
+            raise
+        except Exception:
+            logger.exception('Processing of {key} failed'.format(key=item.key))
+            progress.incr('failed')
+            PRODUCTS.inc(result='failed')
+        finally:
+            self._slot_freed.set()
+
+        self._acks.append(item)
+        if self._acking is None or self._acking.done():
+            self._acking = asyncio.ensure_future(self._flush_acks())
+
+    async def _flush_acks(self) -> None:
+        while self._acks:
+            items, self._acks = self._acks, []
+            try:
+                await self.queue.ack_many(items)
+            except Exception:
+                # Not acknowledged products will be redelivered
+                logger.exception('Failed to acknowledge {count} products'.format(
+                    count=len(items)))
+
+    async def _process(self, item: QueueItem, progress: JobProgress) -> None:
+        if item.body is None:
+            # Product was removed from the queue after it was claimed
+            progress.incr('skipped')
+            PRODUCTS.inc(result='skipped')
+            return
+
+        data = item.data
+        force = data.get('force', False)
+        if not force and await self.processed.contains(data['user_id'], data['product_id']):
+            logger.info('Product {key} already processed, skip it'.format(key=item.key))
+            progress.incr('skipped')
+            PRODUCTS.inc(result='skipped')
+            return
+
+        await async_image_process(self.app, data['product_id'], data['user_id'],
+                                  data['image_urls'], data['image_text'], force, progress,
+                                  data.get('preprocess'), data.get('phrases'), data.get('match'))
+
+
+async def init_dispatcher(app: web.Application) -> web.Application:
+    """ Start background dispatcher
+
+    :param app: Web application
+    :return: Web application
+    """
+    config = app['config']['dispatcher']
+
+    app['dispatcher'] = Dispatcher(
+        app,
+        concurrency=config['concurrency'],
+        pending_limit=config['pending_limit'],
+        poll_interval=config['poll_interval'],
+        drain_timeout=config['drain_timeout'],
+    )
+    app['dispatcher'].start()
+
+    return app
+
+
+async def close_dispatcher(app: web.Application) -> web.Application:
+    """ Stop background dispatcher and drain claimed products
+
+    :param app: Web application
+    :return: Web application
+    """
+    await app['dispatcher'].stop()
+
+    return app
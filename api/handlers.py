@@ -1,100 +1,248 @@
+import csv
+import io
+from datetime import datetime
 from json import JSONDecodeError
 
 import ujson
 from aiohttp import web
 from aiohttp_apispec import request_schema
 
-from api.db.db_helpers import get_result_from_db
+from api.db.db_helpers import (
+    get_result_from_db, get_result_count, decode_cursor, export_query, iterate_results,
+    search_texts)
+from api.queue import task_key
 from api.schemas import UrlsDataSchema, ProductIdSchema
-from api.tasks import async_image_process
+from utils.logging import create_logger
+from utils.profiling import profile
 from utils.security import login_required
 
+logger = create_logger(__name__)
+
+EXPORT_FIELDS = ('product_id', 'image_url', 'image_text', 'phrases', 'created_at')
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
 
 @login_required
 async def get_urls_for_recognition(request: web.Request) -> web.Response:
-    """ Get all images urls from Redis.
+    """ Get queued products of current user from Redis.
 
     :param request: web request
     :return: web response in json format
     """
-    redis = request.app['create_redis']
+    queue = request.app['queue']
+    user_id = request['user']['id']
 
-    data = await redis.keys('*:start_id*')
+    count = await queue.count(user_id)
 
-    if len(data) < 50:
-        response_data = {"ids": data}
+    if count < 50:
+        response_data = {"ids": await queue.keys(user_id)}
     else:
-        response_data = {"ids_count": len(data)}
+        response_data = {"ids_count": count}
 
     return web.json_response(response_data, dumps=ujson.dumps)
 
 
+def create_task_body(user_id: int, data: dict) -> dict:
+    """ Create body of queued task from submitted product. ``image_text`` is the first
+    of checked phrases, repeated phrases are checked once.
+
+    :param user_id: Id of user who submitted the product
+    :param data: Submitted product data
+    :return: Task body
+    """
+    phrases = list(dict.fromkeys([data['image_text']] + (data.get('phrases') or [])))
+    return {
+        'product_id': str(data['product_id']),
+        'user_id': user_id,
+        'image_urls': data['images_urls'],
+        'image_text': data['image_text'],
+        'phrases': phrases if len(phrases) > 1 else None,
+        'force': bool(data.get('force', False)),
+        'preprocess': data.get('preprocess'),
+        'match': data.get('match'),
+    }
+
+
 @login_required
 @request_schema(UrlsDataSchema)
 async def post_urls_for_recognition(request: web.Request) -> web.Response:
-    """ Set all images to Redis.
+    """ Put product images to the work queue. Already processed products are skipped
+    unless ``force`` flag is set.
 
     :param request: web request
-    :return: web response with 201 status code or 400 if invalid json body
+    :return: web response with 201 status code, 200 if product already processed
+        or 400 if invalid json body
     """
-    redis = request.app['create_redis']
+    queue = request.app['queue']
+    processed = request.app['processed']
+    user_id = request['user']['id']
     try:
         data = await request.json()
     except JSONDecodeError:
         return web.json_response({'message': 'JSON body is not correct'}, status=400)
 
-    task_body = {
-        'image_urls': data['images_urls'],
-        'image_text': data['image_text']
-    }
+    errors = UrlsDataSchema().validate(data)
+    if errors:
+        return web.json_response({'errors': errors}, status=400)
+
+    task_body = create_task_body(user_id, data)
 
-    await redis.set('{}:start_id'.format(str(data['product_id'])), ujson.dumps(task_body))
+    if not task_body['force'] and await processed.contains(user_id, task_body['product_id']):
+        return web.json_response({'message': 'Product already processed'})
+
+    await queue.enqueue(task_key(user_id, task_body['product_id']), task_body)
 
     return web.HTTPCreated()
 
 
+async def read_batch_items(request: web.Request, max_body_size: int):
+    """ Read items of batch request. NDJSON body is read incrementally line by line,
+    JSON array body is read at once up to ``max_body_size`` bytes.
+
+    :param request: web request
+    :param max_body_size: Max size of JSON array body
+    :return: Async generator of (index, item) pairs, item is None if it is not valid JSON
+    """
+    if request.content_type == 'application/x-ndjson':
+        index = 0
+        async for line in request.content:
+            if not line.strip():
+                continue
+            try:
+                yield index, ujson.loads(line)
+            except ValueError:
+                yield index, None
+            index += 1
+        return
+
+    body = bytearray()
+    async for chunk in request.content.iter_chunked(2 ** 16):
+        body.extend(chunk)
+        if len(body) > max_body_size:
+            raise web.HTTPRequestEntityTooLarge(max_size=max_body_size, actual_size=len(body))
+
+    items = ujson.loads(bytes(body))
+    if not isinstance(items, list):
+        raise ValueError('JSON array expected')
+
+    for index, item in enumerate(items):
+        yield index, item
+
+
+@login_required
+async def post_urls_batch_for_recognition(request: web.Request) -> web.Response:
+    """ Put many products to the work queue. Body is JSON array or NDJSON stream
+    (``Content-Type: application/x-ndjson``) of items in ``UrlsDataSchema`` format.
+    Products are enqueued in batches, invalid items are reported by their index
+    without failing the whole request.
+
+    :param request: web request
+    :return: web response in json format with counters and per-item errors
+    """
+    queue = request.app['queue']
+    processed = request.app['processed']
+    user_id = request['user']['id']
+    config = request.app['config']['batch']
+
+    schema = UrlsDataSchema()
+    stats = {'received': 0, 'queued': 0, 'updated': 0, 'skipped': 0}
+    errors = []
+    tasks = []
+
+    async def flush():
+        bodies = [body for body in tasks if body['force']]
+        checked = [body for body in tasks if not body['force']]
+        exists = await processed.contains_many(user_id, [body['product_id'] for body in checked])
+        bodies.extend(body for body, exist in zip(checked, exists) if not exist)
+
+        stats['skipped'] += len(tasks) - len(bodies)
+        if bodies:
+            queued = await queue.enqueue_many(
+                [(task_key(user_id, body['product_id']), body) for body in bodies]
+            )
+            stats['queued'] += queued
+            stats['updated'] += len(bodies) - queued
+        tasks.clear()
+
+    try:
+        async for index, item in read_batch_items(request, config['max_body_size']):
+            stats['received'] += 1
+            item_errors = schema.validate(item) if isinstance(item, dict) else {
+                '_schema': ['Item is not a JSON object']}
+            if item_errors:
+                if len(errors) < config['max_errors']:
+                    errors.append({'index': index, 'errors': item_errors})
+                continue
+
+            tasks.append(create_task_body(user_id, item))
+            if len(tasks) >= config['enqueue_batch']:
+                await flush()
+    except (ValueError, TypeError):
+        return web.json_response({'message': 'JSON body is not correct'}, status=400)
+
+    await flush()
+
+    stats['failed'] = stats['received'] - stats['queued'] - stats['updated'] - stats['skipped']
+    return web.json_response(dict(stats, errors=errors), dumps=ujson.dumps)
+
+
 @login_required
 @request_schema(ProductIdSchema)
 async def delete_urls_for_recognition(request: web.Request) -> web.Response:
-    """ Delete images urls from Redis by product id.
+    """ Delete product from the work queue by product id.
 
     :param request: web request
     :return: web response with 204 status code
     """
-    redis = request.app['create_redis']
+    queue = request.app['queue']
     product_id = request.match_info['product_id']
 
-    redis_key = '{}:start_id'.format(product_id)
-
-    await redis.delete(redis_key)
+    await queue.remove(task_key(request['user']['id'], product_id))
 
     return web.HTTPNoContent()
 
 
 @login_required
 async def start_processing_images(request: web.Request) -> web.Response:
-    """ Start processing images
+    """ Start processing images. Queue is drained in background by dispatchers,
+    response contains id of the running job at once.
+
+    Only one job runs at a time and it drains queued products of all users,
+    so if job is already running, its id is returned and products of current user
+    are processed by it. Every user sees progress of own products in the job.
 
     :param request: web request
-    :return:
+    :return: web response with 202 status code in json format
     """
-    tasks = request.app['tasks']
-    redis = request.app['create_redis']
-    scheduler = request.app['AIOJOBS_SCHEDULER']
+    depth = await request.app['queue'].depth()
+    job_id, created = await request.app['jobs'].start(request['user']['id'], depth['total'])
+
+    if created:
+        logger.info('Job {id} started with {total} products'.format(
+            id=job_id, total=depth['total']))
+
+    return web.json_response({'job_id': job_id, 'created': created}, status=202)
+
 
-    keys = await redis.keys('*:start_id*')
-    for key in keys:
-        data = await redis.get(key, encoding='utf-8')
-        data = ujson.loads(data)
-        task = scheduler.spawn(
-            async_image_process(request, key, data['image_urls'], data['image_text'])
-        )
-        tasks.append(task)
+@login_required
+async def get_job(request: web.Request) -> web.Response:
+    """ Get processing job by id with progress statistics of products of current user
+    in all processes: products queued, in progress, matched, not matched, failed, skipped,
+    images downloading and recognizing at the moment, throughput (products/s) and ETA (s).
 
-        await task
-        await redis.delete(key)
+    :param request: web request
+    :return: web response in json format or 404 if job does not exist
+    """
+    user_id = request['user']['id']
+    queued = await request.app['queue'].count(user_id)
+    job = await request.app['jobs'].stats(request.match_info['job_id'], queued, user_id)
+    if job is None:
+        return web.json_response({'message': 'Job not found'}, status=404)
 
-    return web.Response()
+    return web.json_response(job, dumps=ujson.dumps)
 
 
 @login_required
@@ -110,27 +258,179 @@ async def get_all_running_tasks_count(request: web.Request) -> web.Response:
     data = {
         'running_tasks': running_tasks_count,
         'pending_tasks': pending_tasks_count,
+        'ocr_cache': request.app['ocr_cache'].info(),
+        'redis_pool': {
+            'size': request.app['create_redis'].connection.size,
+            'free': request.app['create_redis'].connection.freesize,
+            'max_size': request.app['create_redis'].connection.maxsize,
+        },
     }
     return web.json_response(data)
 
 
 @login_required
 async def get_json_result(request: web.Request) -> web.Response:
-    """ Get all paginated results from tasks.
+    """ Get all paginated results from tasks. Next page is requested with ``after`` token
+    from previous response. Count is cached, ``count=exact`` query param recounts rows.
 
     :param request: web request
     :return: web response in json format
     """
     query = request.query
+    config = request.app['config']['results']
 
     try:
         offset = int(query.get('offset', 0))
-        limit = int(query.get('limit', 24))
+        limit = int(query.get('limit', config['default_limit']))
+        after = decode_cursor(query['after']) if query.get('after') else None
     except ValueError:
         return web.json_response({'message': 'Invalid query params'}, dumps=ujson.dumps)
 
-    limit = min(limit, 24)
+    limit = max(min(limit, config['max_limit']), 1)
+
+    data, next_token = await get_result_from_db(request, limit, after, offset)
+    row_count = await get_result_count(request, exact=query.get('count') == 'exact')
+
+    return web.json_response(
+        {'count': row_count, 'next': next_token, 'results': data}, dumps=ujson.dumps
+    )
+
+
+@login_required
+async def search_products(request: web.Request) -> web.Response:
+    """ Search images of processed products by phrase in recognized text.
+    Query params: ``q`` phrase, ``limit`` and ``after`` token from previous response.
+
+    :param request: web request
+    :return: web response in json format
+    """
+    query = request.query
+    config = request.app['config']['results']
+
+    phrase = query.get('q', '').strip()
+    try:
+        if not phrase:
+            raise ValueError('q')
+        limit = int(query.get('limit', config['default_limit']))
+        after = decode_cursor(query['after']) if query.get('after') else None
+    except ValueError:
+        return web.json_response({'message': 'Invalid query params'}, status=400)
+
+    limit = max(min(limit, config['max_limit']), 1)
+    data, next_token = await search_texts(request, phrase, limit, after)
+
+    return web.json_response({'next': next_token, 'results': data}, dumps=ujson.dumps)
+
+
+def serialize_rows(rows: list, export_format: str) -> bytes:
+    """ Serialize chunk of exported rows
+
+    :param rows: Rows from db
+    :param export_format: ndjson or csv
+    :return: Serialized chunk
+    """
+    rows = [[row[field] for field in EXPORT_FIELDS] for row in rows]
+    for row in rows:
+        row[-1] = row[-1].isoformat()
+
+    if export_format == 'csv':
+        for row in rows:
+            row[-2] = ujson.dumps(row[-2]) if row[-2] is not None else ''
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+
+    return ''.join(
+        ujson.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n' for row in rows
+    ).encode('utf-8')
+
+
+@login_required
+async def export_results(request: web.Request) -> web.StreamResponse:
+    """ Stream all results of user in one response. Query params:
+    ``format`` (ndjson or csv), ``gzip``, ``since`` and ``until`` (ISO dates of processing),
+    ``found`` (true or false).
+
+    :param request: web request
+    :return: streamed web response
+    """
+    query = request.query
+    export_format = query.get('format', 'ndjson')
+
+    try:
+        if export_format not in EXPORT_CONTENT_TYPES:
+            raise ValueError(export_format)
+        since = datetime.fromisoformat(query['since']) if query.get('since') else None
+        until = datetime.fromisoformat(query['until']) if query.get('until') else None
+        found = {'true': True, 'false': False, None: None}[query.get('found')]
+    except (ValueError, KeyError):
+        return web.json_response({'message': 'Invalid query params'}, status=400)
+
+    response = web.StreamResponse(headers={'Content-Type': EXPORT_CONTENT_TYPES[export_format]})
+    if query.get('gzip') in ('1', 'true'):
+        response.enable_compression(web.ContentCoding.gzip)
+    await response.prepare(request)
+
+    if export_format == 'csv':
+        await response.write(','.join(EXPORT_FIELDS).encode('utf-8') + b'\r\n')
+
+    chunk_size = request.app['config']['results']['export_chunk_size']
+    select = export_query(request['user']['id'], since, until, found)
+
+    async with request.app['db'].acquire() as connection:
+        async with connection.begin():
+            async for rows in iterate_results(connection, select, chunk_size):
+                await response.write(serialize_rows(rows, export_format))
+
+    await response.write_eof()
+    return response
+
+
+async def get_metrics(request: web.Request) -> web.Response:
+    """ Get metrics of all processes in Prometheus text format.
+
+    :param request: web request
+    :return: web response in text format
+    """
+    depth = await request.app['queue'].depth()
+    queue_lines = [
+        '# HELP queue_depth Products in the work queue',
+        '# TYPE queue_depth gauge',
+    ]
+    for state in ('waiting', 'in_progress'):
+        queue_lines.append('queue_depth{{state="{}"}} {}'.format(state, depth[state]))
+
+    text = await request.app['metrics'].render(queue_lines)
+
+    return web.Response(text=text, content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+@login_required
+async def profile_process(request: web.Request) -> web.Response:
+    """ Profile process that handles request for ``seconds`` query param seconds and return
+    report. ``threads=true`` also profiles threads if yappi is installed.
+
+    :param request: web request
+    :return: web response in text format
+    """
+    config = request.app['config']['profiling']
+    if not config['enabled'] or request['user']['email'] not in config['admins']:
+        return web.json_response({'message': 'Forbidden'}, status=403)
+
+    try:
+        seconds = float(request.query.get('seconds', 10))
+    except ValueError:
+        return web.json_response({'message': 'Invalid query params'}, status=400)
+    seconds = max(min(seconds, config['max_seconds']), 0.1)
+
+    lock = request.app['profiling_lock']
+    if lock.locked():
+        return web.json_response({'message': 'Profiling is already running'}, status=409)
 
-    data, row_count = await get_result_from_db(request, limit, offset)
+    async with lock:
+        logger.info('Profiling for {seconds}s started by {email}'.format(
+            seconds=seconds, email=request['user']['email']))
+        report = await profile(seconds, threads=request.query.get('threads') in ('1', 'true'))
 
-    return web.json_response({'count': row_count, 'results': data}, dumps=ujson.dumps)
+    return web.Response(text=report, content_type='text/plain', charset='utf-8')
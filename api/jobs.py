@@ -0,0 +1,248 @@
+import asyncio
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Optional
+
+import aioredis
+from aiohttp import web
+
+from utils.logging import create_logger
+
+logger = create_logger(__name__)
+
+# Counters of processed products, all other counters are gauges of products and images in progress
+DONE_COUNTERS = ('matched', 'not_matched', 'failed', 'skipped')
+PROGRESS_COUNTERS = ('processing', 'downloading', 'recognizing')
+
+# Return id of running job or register new one as running
+START_SCRIPT = """
+local active = redis.call('GET', KEYS[1])
+if active then
+    return {active, 0}
+end
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], 'id', ARGV[1], 'status', 'running', 'user_id', ARGV[2],
+           'total', ARGV[3], 'started_at', ARGV[4])
+return {ARGV[1], 1}
+"""
+
+# Mark job as finished only if it is still the running one
+FINISH_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[2], 'status', 'finished', 'finished_at', ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 1
+"""
+
+
+def user_field(user_id: int, field: str) -> str:
+    """ Name of job counter of products of user
+
+    :param user_id: User id
+    :param field: Counter name
+    :return: Field name in job hash
+    """
+    return 'user:{user_id}:{field}'.format(user_id=user_id, field=field)
+
+
+class JobStore:
+    """ Client-visible handles of processing runs stored in Redis.
+
+    Only one job runs at a time: it is started by request and lasts until
+    the queue is drained by dispatchers of all processes. Progress counters
+    are accumulated in process and added to job hash every ``flush_interval``
+    seconds, so job hash holds totals of all processes.
+    """
+
+    def __init__(self, redis: aioredis.Redis, prefix: str, ttl: int, flush_interval: float):
+        self.redis = redis
+        self.prefix = prefix
+        self.active_key = '{prefix}:active'.format(prefix=prefix)
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._deltas = defaultdict(lambda: defaultdict(int))
+        self._flusher = None
+
+    def start_flushing(self) -> None:
+        self._flusher = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+
+    def incr(self, job_id: str, field: str, amount: int = 1) -> None:
+        """ Change progress counter of job
+
+        :param job_id: Job id
+        :param field: Counter name
+        :param amount: Counter delta
+        :return:
+        """
+        self._deltas[job_id][field] += amount
+
+    async def flush(self) -> None:
+        """ Add accumulated progress counters to job hashes
+
+        :return:
+        """
+        deltas, self._deltas = self._deltas, defaultdict(lambda: defaultdict(int))
+        if not deltas:
+            return
+
+        pipe = self.redis.pipeline()
+        for job_id, counters in deltas.items():
+            for field, amount in counters.items():
+                if amount:
+                    pipe.hincrby(self.key(job_id), field, amount)
+        await pipe.execute()
+
+    def key(self, job_id: str) -> str:
+        return '{prefix}:{job_id}'.format(prefix=self.prefix, job_id=job_id)
+
+    async def start(self, user_id: int, total: int) -> tuple:
+        """ Start new job if no job is running
+
+        :param user_id: Id of user who started the job
+        :param total: Count of queued products
+        :return: Job id and flag if job was created
+        """
+        job_id = uuid.uuid4().hex
+        active_id, created = await self.redis.eval(
+            START_SCRIPT, keys=[self.active_key, self.key(job_id)],
+            args=[job_id, user_id, total, time.time()]
+        )
+        return active_id.decode('utf-8'), bool(created)
+
+    async def active(self) -> Optional[str]:
+        """ Get id of running job
+
+        :return: Job id or None if no job is running
+        """
+        return await self.redis.get(self.active_key, encoding='utf-8')
+
+    async def finish(self, job_id: str) -> bool:
+        """ Finish running job
+
+        :param job_id: Job id
+        :return: True if job was finished by this call
+        """
+        return bool(await self.redis.eval(
+            FINISH_SCRIPT, keys=[self.active_key, self.key(job_id)],
+            args=[job_id, time.time(), self.ttl]
+        ))
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        """ Get job by id
+
+        :param job_id: Job id
+        :return: Dict with job fields or None if job does not exist
+        """
+        return await self.redis.hgetall(self.key(job_id), encoding='utf-8') or None
+
+    async def stats(self, job_id: str, waiting: int, user_id: int = None) -> Optional[dict]:
+        """ Get job with progress statistics of all products or only of products of user
+
+        :param job_id: Job id
+        :param waiting: Count of products waiting in the queue, for statistics of user -
+            count of queued products of user including products in progress
+        :param user_id: Count only products of this user
+        :return: Dict with job statistics or None if job does not exist
+        """
+        job = await self.get(job_id)
+        if job is None:
+            return None
+
+        prefix = user_field(user_id, '') if user_id is not None else ''
+        stats = {
+            field: int(job.get(prefix + field, 0))
+            for field in DONE_COUNTERS + PROGRESS_COUNTERS
+        }
+        done = sum(stats[field] for field in DONE_COUNTERS)
+        running = job['status'] == 'running'
+        if user_id is not None:
+            waiting = max(waiting - stats['processing'], 0)
+        queued = waiting if running else 0
+
+        started_at = float(job['started_at'])
+        finished_at = float(job['finished_at']) if 'finished_at' in job else time.time()
+        elapsed = max(finished_at - started_at, 0.001)
+        throughput = done / elapsed
+        eta = (stats['processing'] + queued) / throughput if running and done else None
+
+        return dict(
+            stats,
+            id=job['id'],
+            status=job['status'],
+            user_id=int(job['user_id']),
+            started_at=started_at,
+            finished_at=float(job['finished_at']) if 'finished_at' in job else None,
+            total=max(int(job['total']) if user_id is None else 0,
+                      done + stats['processing'] + queued),
+            queued=queued,
+            done=done,
+            throughput=round(throughput, 3),
+            eta=round(eta, 1) if eta is not None else None,
+        )
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except aioredis.RedisError:
+                logger.exception('Failed to store job progress')
+
+
+class JobProgress:
+    """ Progress counters of one job, does nothing if product is processed out of job.
+    Counters are also kept per user of product, so every user sees progress of own products.
+    """
+
+    def __init__(self, store: JobStore, job_id: Optional[str], user_id: int = None):
+        self.store = store
+        self.job_id = job_id
+        self.user_id = user_id
+
+    def incr(self, field: str, amount: int = 1) -> None:
+        if self.job_id is not None:
+            self.store.incr(self.job_id, field, amount)
+            if self.user_id is not None:
+                self.store.incr(self.job_id, user_field(self.user_id, field), amount)
+
+    @contextmanager
+    def stage(self, field: str):
+        """ Count item in progress gauge while context is active
+
+        :param field: Gauge name
+        :return:
+        """
+        self.incr(field)
+        try:
+            yield
+        finally:
+            self.incr(field, -1)
+
+
+async def jobs(app: web.Application) -> None:
+    """ Create job store on top of redis connection
+
+    :param app: Web application
+    :return:
+    """
+    config = app['config']['jobs']
+
+    app['jobs'] = JobStore(
+        app['create_redis'], config['prefix'], config['ttl'], config['flush_interval']
+    )
+    app['jobs'].start_flushing()
+
+    yield
+
+    await app['jobs'].close()
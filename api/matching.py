@@ -0,0 +1,80 @@
+MODES = ('exact', 'normalized', 'fuzzy')
+
+
+def normalize(text: str) -> str:
+    """ Case-fold text and collapse whitespace
+
+    :param text: Text
+    :return: Normalized text
+    """
+    return ' '.join(text.casefold().split())
+
+
+def fuzzy_contains(text: str, phrase: str, max_distance: int) -> bool:
+    """ Check if text contains substring within ``max_distance`` edits
+    (insertions, deletions, substitutions) of phrase. Sellers algorithm,
+    O(len(text) * len(phrase)).
+
+    :param text: Text
+    :param phrase: Phrase
+    :param max_distance: Max edit distance
+    :return: True if phrase is found
+    """
+    if len(phrase) <= max_distance:
+        return True
+
+    # Distances of phrase prefixes to the best substring ending at current char,
+    # substring can start anywhere, so first row is zero
+    previous = list(range(len(phrase) + 1))
+    for char in text:
+        current = [0]
+        for index, phrase_char in enumerate(phrase, 1):
+            current.append(min(
+                previous[index] + 1,
+                current[index - 1] + 1,
+                previous[index - 1] + (phrase_char != char),
+            ))
+        if current[-1] <= max_distance:
+            return True
+        previous = current
+    return False
+
+
+class Matcher:
+    """ Checks many phrases against one recognized text """
+
+    def __init__(self, phrases: list, mode: str = 'exact', max_distance: int = 1):
+        self.phrases = phrases
+        self.mode = mode
+        self.max_distance = max_distance
+        if mode == 'exact':
+            self._prepared = phrases
+        else:
+            self._prepared = [normalize(phrase) for phrase in phrases]
+
+    @property
+    def cpu_bound(self) -> bool:
+        """ Fuzzy matching of long texts is too slow for the event loop """
+        return self.mode == 'fuzzy'
+
+    def match(self, text: str) -> frozenset:
+        """ Find phrases in text
+
+        :param text: Recognized text
+        :return: Indexes of found phrases
+        """
+        if self.mode == 'exact':
+            return frozenset(
+                index for index, phrase in enumerate(self._prepared) if phrase in text
+            )
+
+        text = normalize(text)
+        if self.mode == 'normalized':
+            return frozenset(
+                index for index, phrase in enumerate(self._prepared) if phrase in text
+            )
+
+        return frozenset(
+            index for index, phrase in enumerate(self._prepared)
+            if phrase in text or fuzzy_contains(text, phrase, self.max_distance)
+        )
@@ -0,0 +1,324 @@
+import asyncio
+import os
+import re
+import socket
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import aioredis
+from aiohttp import web
+
+from utils.logging import create_logger
+
+logger = create_logger(__name__)
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7)
+
+
+LABEL_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+
+
+def format_labels(labels: dict) -> str:
+    return ','.join('{}="{}"'.format(key, value) for key, value in sorted(labels.items()))
+
+
+def parse_labels(labels: str) -> dict:
+    return dict(LABEL_PATTERN.findall(labels))
+
+
+class Metric:
+    """ Base of metrics that are accumulated in process and added to Redis
+    on flush, so scraped values are totals of all processes.
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._deltas = defaultdict(float)
+        REGISTRY.append(self)
+
+    def collect(self) -> dict:
+        """ Take accumulated deltas
+
+        :return: Dict with field and delta
+        """
+        deltas, self._deltas = self._deltas, defaultdict(float)
+        return deltas
+
+    def render(self, fields: dict) -> list:
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        for field, value in sorted(fields.items()):
+            lines.append(self.render_sample(field, value))
+        return lines
+
+    def render_sample(self, field: str, value: str) -> str:
+        name, _, labels = field.partition('|')
+        labels = '{{{}}}'.format(labels) if labels else ''
+        return '{}{}{} {}'.format(self.name, name, labels, value)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        self._deltas['|' + format_labels(labels)] += amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels) -> None:
+        """ Observe value, buckets are stored cumulative as in exposition format
+
+        :param value: Observed value
+        :param labels: Labels
+        :return:
+        """
+        for bound in self.buckets:
+            if value <= bound:
+                self._deltas['_bucket|' + format_labels(dict(labels, le=bound))] += 1
+        self._deltas['_bucket|' + format_labels(dict(labels, le='+Inf'))] += 1
+        self._deltas['_sum|' + format_labels(labels)] += value
+        self._deltas['_count|' + format_labels(labels)] += 1
+
+    def render(self, fields: dict) -> list:
+        """ Render every configured bucket in increasing order of bound for each label set,
+        buckets that were never hit are not stored and have the value of previous bucket
+
+        :param fields: Dict with field and value
+        :return: Lines of metric
+        """
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        label_sets = sorted(field.partition('|')[2] for field in fields
+                            if field.startswith('_count|'))
+        for labels in label_sets:
+            parsed = parse_labels(labels)
+            value = '0'
+            for bound in self.buckets + ('+Inf',):
+                field = '_bucket|' + format_labels(dict(parsed, le=bound))
+                value = fields.get(field, value)
+                lines.append(self.render_sample(field, value))
+            for suffix in ('_sum|', '_count|'):
+                lines.append(self.render_sample(suffix + labels, fields[suffix + labels]))
+        return lines
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+class Gauge:
+    """ Point-in-time value of process, reported by its callback on every flush """
+
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        GAUGES.append(self)
+
+
+class InFlight:
+    """ Count of operations running in process at the moment """
+
+    def __init__(self):
+        self.count = 0
+
+    @contextmanager
+    def track(self):
+        self.count += 1
+        try:
+            yield
+        finally:
+            self.count -= 1
+
+
+REGISTRY = []
+GAUGES = []
+
+IMAGE_DOWNLOAD_SECONDS = Histogram('image_download_seconds', 'Image download time')
+IMAGE_DOWNLOAD_BYTES = Histogram('image_download_bytes', 'Downloaded image size', BYTES_BUCKETS)
+IMAGE_DECODE_SECONDS = Histogram('image_decode_seconds', 'Image decode time')
+OCR_SECONDS = Histogram('ocr_seconds', 'Text recognition time of one image')
+OCR_CACHE_LOOKUPS = Counter('ocr_cache_lookups_total', 'OCR cache lookups by result')
+DB_WRITE_SECONDS = Histogram('db_write_seconds', 'Results batch write time')
+DB_WRITE_ROWS = Counter('db_write_rows_total', 'Results written to database')
+PRODUCTS = Counter('products_total', 'Processed products by result')
+REDIS_COMMAND_SECONDS = Histogram('redis_command_seconds', 'Redis command latency')
+
+OCR_POOL_QUEUE = Gauge('ocr_pool_queue_length', 'Images waiting for OCR worker')
+OCR_POOL_BUSY = Gauge('ocr_pool_busy_workers', 'OCR workers recognizing images')
+DB_POOL_SIZE = Gauge('db_pool_size', 'Opened database connections')
+DB_POOL_FREE = Gauge('db_pool_free', 'Free database connections')
+REDIS_POOL_SIZE = Gauge('redis_pool_size', 'Opened redis connections')
+REDIS_POOL_FREE = Gauge('redis_pool_free', 'Redis connections not taken by transactions')
+PRODUCTS_IN_PROGRESS = Gauge('products_in_progress', 'Products processed by dispatcher')
+
+OCR_IN_FLIGHT = InFlight()
+
+
+class MetricsStore:
+    """ Redis storage of metrics. Counters and histograms are summed up
+    in one hash per metric, gauges are kept per process and expire
+    when process stops reporting.
+    """
+
+    def __init__(self, redis: aioredis.Redis, prefix: str, process: str, flush_interval: float):
+        self.redis = redis
+        self.prefix = prefix
+        self.process = process
+        self.processes = '{prefix}:processes'.format(prefix=prefix)
+        self.flush_interval = flush_interval
+        self._flusher = None
+
+    def key(self, name: str) -> str:
+        return '{prefix}:{name}'.format(prefix=self.prefix, name=name)
+
+    def start_flushing(self, collect_gauges) -> None:
+        """ Start periodic flush
+
+        :param collect_gauges: Function that returns dict with gauge and value
+        :return:
+        """
+        self._flusher = asyncio.ensure_future(self._flush_periodically(collect_gauges))
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush({})
+
+    async def flush(self, gauges: dict) -> None:
+        """ Add accumulated metrics to Redis and replace gauges of current process
+
+        :param gauges: Dict with gauge and value
+        :return:
+        """
+        started = time.perf_counter()
+        await self.redis.ping()
+        REDIS_COMMAND_SECONDS.observe(time.perf_counter() - started, command='ping')
+
+        pipe = self.redis.pipeline()
+        for metric in REGISTRY:
+            for field, delta in metric.collect().items():
+                pipe.hincrbyfloat(self.key(metric.name), field, delta)
+
+        if gauges:
+            key = self.key('gauges:{process}'.format(process=self.process))
+            pipe.delete(key)
+            pipe.hmset_dict(key, {gauge.name: value for gauge, value in gauges.items()})
+            pipe.expire(key, int(self.flush_interval * 3) + 1)
+            now = time.time()
+            pipe.zadd(self.processes, now, self.process)
+            pipe.zremrangebyscore(self.processes, max=now - self.flush_interval * 3)
+        await pipe.execute()
+
+    async def render(self, extra: list = ()) -> str:
+        """ Render all metrics in Prometheus text format
+
+        :param extra: Lines of metrics computed at scrape time
+        :return: Metrics text
+        """
+        pipe = self.redis.pipeline()
+        for metric in REGISTRY:
+            pipe.hgetall(self.key(metric.name), encoding='utf-8')
+        pipe.zrangebyscore(self.processes, min=time.time() - self.flush_interval * 3,
+                           encoding='utf-8')
+        *values, processes = await pipe.execute()
+
+        lines = []
+        for metric, fields in zip(REGISTRY, values):
+            lines.extend(metric.render(fields))
+
+        pipe = self.redis.pipeline()
+        for process in processes:
+            pipe.hgetall(self.key('gauges:{process}'.format(process=process)), encoding='utf-8')
+        process_gauges = await pipe.execute() if processes else []
+
+        for gauge in GAUGES:
+            lines.append('# HELP {} {}'.format(gauge.name, gauge.documentation))
+            lines.append('# TYPE {} gauge'.format(gauge.name))
+            for process, gauges in zip(processes, process_gauges):
+                if gauge.name in gauges:
+                    lines.append('{}{{process="{}"}} {}'.format(gauge.name, process,
+                                                                 gauges[gauge.name]))
+
+        lines.extend(extra)
+        return '\n'.join(lines) + '\n'
+
+    async def _flush_periodically(self, collect_gauges) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush(collect_gauges())
+            except aioredis.RedisError:
+                logger.exception('Failed to store metrics')
+
+
+def collect_gauges(app: web.Application) -> dict:
+    """ Get current values of process gauges
+
+    :param app: Web application
+    :return: Dict with gauge and value
+    """
+    ocr_workers = app['config']['ocr']['processes'] or os.cpu_count()
+    gauges = {
+        OCR_POOL_QUEUE: max(OCR_IN_FLIGHT.count - ocr_workers, 0),
+        OCR_POOL_BUSY: min(OCR_IN_FLIGHT.count, ocr_workers),
+        DB_POOL_SIZE: app['db'].size,
+        DB_POOL_FREE: app['db'].freesize,
+        REDIS_POOL_SIZE: app['create_redis'].connection.size,
+        REDIS_POOL_FREE: app['create_redis'].connection.freesize,
+    }
+    if 'AIOJOBS_SCHEDULER' in app:
+        gauges[PRODUCTS_IN_PROGRESS] = app['AIOJOBS_SCHEDULER'].active_count
+    return gauges
+
+
+async def metrics(app: web.Application) -> None:
+    """ Create metrics store and flush metrics of process until application stops
+
+    :param app: Web application
+    :return:
+    """
+    config = app['config']['metrics']
+
+    app['metrics'] = MetricsStore(
+        app['create_redis'],
+        prefix=config['prefix'],
+        process='{host}-{pid}'.format(host=socket.gethostname(), pid=os.getpid()),
+        flush_interval=config['flush_interval'],
+    )
+
+    yield
+
+    await app['metrics'].close()
+
+
+async def start_metrics(app: web.Application) -> web.Application:
+    """ Start flushing metrics when all gauge sources are initialized
+
+    :param app: Web application
+    :return: Web application
+    """
+    app['metrics'].start_flushing(lambda: collect_gauges(app))
+
+    return app
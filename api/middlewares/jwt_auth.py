@@ -2,19 +2,18 @@ import jwt
 from aiohttp import web
 from aiohttp.web_response import json_response
 
-from api.db.tables import users
-
 
 async def jwt_auth_middleware(app, handler):
     """ Jwt Token Middleware that takes JWT token from Authorization header
-    and validate logged user
+    and validate logged user. User record is taken from cache of users
+    and stored in request, so it is not shared between concurrent requests
 
     :param app: web Application
     :param handler: function that handle input Request
     :return:
     """
     async def middleware(request: web.Request):
-        request.app['user'] = None
+        request['user'] = None
         jwt_config = request.app['config']['jwt_auth']
         jwt_token = request.headers.get('Authorization')
         if jwt_token:
@@ -26,13 +25,9 @@ async def jwt_auth_middleware(app, handler):
                  )
             except (jwt.DecodeError, jwt.ExpiredSignatureError):
                 return json_response({'message': 'Token is invalid'}, status=400)
-            async with app['db'].acquire() as connection:
-                cursor = await connection.execute(
-                    users.select()
-                        .where(users.c.id == payload['user_id'])
-                )
-                user = await cursor.fetchone()
-                request.app['user'] = dict(user)
+            user = await app['users'].get(payload['user_id'])
+            if user is None:
+                return json_response({'message': 'User does not exist'}, status=401)
+            request['user'] = user
         return await handler(request)
     return middleware
-
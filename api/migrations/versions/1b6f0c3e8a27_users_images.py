@@ -0,0 +1,41 @@
+"""users images
+
+Revision ID: 1b6f0c3e8a27
+Revises: 
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b6f0c3e8a27'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # initial schema, databases created before migrations should be stamped with this revision
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer, primary_key=True, index=True),
+        sa.Column('name', sa.String(20), nullable=False),
+        sa.Column('last_name', sa.String(20), nullable=False),
+        sa.Column('email', sa.String(50), unique=True, nullable=False),
+        sa.Column('password', sa.Text, nullable=False),
+    )
+    op.create_table(
+        'images',
+        sa.Column('id', sa.Integer, primary_key=True, index=True),
+        sa.Column('product_id', sa.String(20), nullable=False),
+        sa.Column('image_url', sa.String, nullable=False),
+        sa.Column('image_text', sa.String, nullable=False),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id', ondelete='CASCADE')),
+    )
+
+
+def downgrade():
+    op.drop_table('images')
+    op.drop_table('users')
@@ -0,0 +1,34 @@
+"""images user_id product_id unique
+
+Revision ID: 3f1c2a9b7d10
+Revises: 1b6f0c3e8a27
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d10'
+down_revision = '1b6f0c3e8a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep only the first result of every product before adding constraint
+    op.execute("""
+        DELETE FROM images a
+            USING images b
+        WHERE a.user_id = b.user_id
+            AND a.product_id = b.product_id
+            AND a.id > b.id
+    """)
+    op.create_unique_constraint(
+        'uq_images_user_id_product_id', 'images', ['user_id', 'product_id']
+    )
+
+
+def downgrade():
+    op.drop_constraint('uq_images_user_id_product_id', 'images', type_='unique')
@@ -0,0 +1,24 @@
+"""images user_id id index
+
+Revision ID: 8a4e61d0c2b5
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e61d0c2b5'
+down_revision = '3f1c2a9b7d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_images_user_id_id', 'images', ['user_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_images_user_id_id', table_name='images')
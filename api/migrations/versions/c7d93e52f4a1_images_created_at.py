@@ -0,0 +1,27 @@
+"""images created_at
+
+Revision ID: c7d93e52f4a1
+Revises: 8a4e61d0c2b5
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d93e52f4a1'
+down_revision = '8a4e61d0c2b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'images',
+        sa.Column('created_at', sa.DateTime, nullable=False, server_default=sa.func.now())
+    )
+
+
+def downgrade():
+    op.drop_column('images', 'created_at')
@@ -0,0 +1,45 @@
+"""image texts
+
+Revision ID: d41b7e9a2c36
+Revises: c7d93e52f4a1
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41b7e9a2c36'
+down_revision = 'c7d93e52f4a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'image_texts',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('user_id', sa.Integer, sa.ForeignKey('users.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('product_id', sa.String(20), nullable=False),
+        sa.Column('image_url', sa.String, nullable=False),
+        sa.Column('text', sa.Text, nullable=False),
+        sa.Column('words', postgresql.JSONB, nullable=True),
+        sa.Column('confidence', sa.Float, nullable=True),
+        sa.Column('created_at', sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.UniqueConstraint('user_id', 'product_id', 'image_url',
+                            name='uq_image_texts_user_id_product_id_image_url'),
+    )
+    # generated columns require PostgreSQL 12
+    op.execute(
+        "ALTER TABLE image_texts ADD COLUMN search tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED"
+    )
+    op.create_index('ix_image_texts_search', 'image_texts', ['search'], postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_image_texts_search', table_name='image_texts')
+    op.drop_table('image_texts')
@@ -0,0 +1,25 @@
+"""images phrases
+
+Revision ID: e5a3f0b18d47
+Revises: d41b7e9a2c36
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a3f0b18d47'
+down_revision = 'd41b7e9a2c36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('images', sa.Column('phrases', postgresql.JSONB, nullable=True))
+
+
+def downgrade():
+    op.drop_column('images', 'phrases')
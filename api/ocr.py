@@ -0,0 +1,159 @@
+import os
+from concurrent.futures.process import ProcessPoolExecutor
+
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+from utils.logging import create_logger
+
+logger = create_logger(__name__)
+
+# Settings passed to tesseract, other OCR config keys are not related to recognition
+ENGINE_SETTINGS = ('lang', 'psm', 'oem', 'dpi', 'whitelist')
+
+# Engine state of current OCR worker process
+_api = None
+_settings = {'lang': 'eng', 'psm': 3, 'oem': 3, 'dpi': 0, 'whitelist': ''}
+
+
+def engine_settings(config: dict) -> dict:
+    """ Get tesseract settings from OCR config
+
+    :param config: OCR config
+    :return: Dict with engine settings
+    """
+    return {key: config[key] for key in ENGINE_SETTINGS}
+
+
+def tesseract_config(settings: dict) -> str:
+    """ Build tesseract command line options for settings
+
+    :param settings: Engine settings
+    :return: Options string
+    """
+    options = ['--psm {}'.format(settings['psm']), '--oem {}'.format(settings['oem'])]
+    if settings['dpi']:
+        options.append('--dpi {}'.format(settings['dpi']))
+    if settings['whitelist']:
+        options.append('-c tessedit_char_whitelist={}'.format(settings['whitelist']))
+    return ' '.join(options)
+
+
+def init_worker(settings: dict) -> None:
+    """ Initializer of OCR worker process. Loads tesseract engine
+    and language data once, so every next image is recognized in-process.
+
+    :param settings: Engine settings
+    :return:
+    """
+    global _api, _settings
+
+    _settings = settings
+    if tesserocr is not None:
+        _api = tesserocr.PyTessBaseAPI(
+            lang=settings['lang'], psm=settings['psm'], oem=settings['oem']
+        )
+        if settings['whitelist']:
+            _api.SetVariable('tessedit_char_whitelist', settings['whitelist'])
+
+
+def image_to_string(image) -> str:
+    """ Recognize text on image with engine of current process.
+    Falls back to tesseract subprocess if tesserocr is not installed.
+
+    :param image: PIL image
+    :return: Recognized text
+    """
+    if _api is None:
+        return pytesseract.image_to_string(
+            image, lang=_settings['lang'], config=tesseract_config(_settings)
+        )
+
+    _api.SetImage(image)
+    if _settings['dpi']:
+        _api.SetSourceResolution(_settings['dpi'])
+    return _api.GetUTF8Text()
+
+
+def data_to_text(data: dict) -> str:
+    """ Assemble text from words of tesseract TSV output: words of line are joined
+    with spaces, lines with new line and paragraphs are separated with empty line
+
+    :param data: Output of ``pytesseract.image_to_data`` as dict
+    :return: Recognized text
+    """
+    paragraphs = {}
+    for word, block, paragraph, line in zip(data['text'], data['block_num'], data['par_num'],
+                                            data['line_num']):
+        if word.strip():
+            lines = paragraphs.setdefault((block, paragraph), {})
+            lines.setdefault(line, []).append(word.strip())
+
+    return '\n\n'.join(
+        '\n'.join(' '.join(words) for words in lines.values())
+        for lines in paragraphs.values()
+    )
+
+
+def image_to_data(image) -> tuple:
+    """ Recognize text on image with words, their boxes and confidence.
+    Falls back to tesseract subprocess if tesserocr is not installed.
+
+    :param image: PIL image
+    :return: Recognized text, list of words and mean confidence
+    """
+    if _api is None:
+        # one tesseract run, text is assembled from recognized words
+        data = pytesseract.image_to_data(
+            image, lang=_settings['lang'], config=tesseract_config(_settings),
+            output_type=pytesseract.Output.DICT
+        )
+        words = [
+            {'text': word, 'confidence': float(confidence), 'box': [left, top, width, height]}
+            for word, confidence, left, top, width, height in zip(
+                data['text'], data['conf'], data['left'], data['top'],
+                data['width'], data['height']
+            )
+            if word.strip() and float(confidence) >= 0
+        ]
+        confidence = sum(word['confidence'] for word in words) / len(words) if words else 0
+        return data_to_text(data), words, confidence
+
+    text = image_to_string(image)
+    level = tesserocr.RIL.WORD
+    words = []
+    for word in tesserocr.iterate_level(_api.GetIterator(), level):
+        try:
+            word_text = word.GetUTF8Text(level)
+        except RuntimeError:
+            # iterator has no text on empty page
+            break
+        left, top, right, bottom = word.BoundingBox(level)
+        words.append({
+            'text': word_text,
+            'confidence': round(word.Confidence(level), 2),
+            'box': [left, top, right - left, bottom - top],
+        })
+    return text, words, float(_api.MeanTextConf())
+
+
+def create_ocr_executor(config: dict) -> ProcessPoolExecutor:
+    """ Create pool of long-lived OCR worker processes
+
+    :param config: OCR config
+    :return: Process pool executor
+    """
+    processes = config['processes'] or os.cpu_count()
+
+    if tesserocr is None:
+        logger.warning('Library tesserocr is not available, tesseract will be started per image')
+
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=init_worker,
+        initargs=(engine_settings(config),),
+    )
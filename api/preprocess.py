@@ -0,0 +1,101 @@
+try:
+    from PIL import Image, ImageChops, ImageFilter
+except ImportError:
+    import Image
+    import ImageChops
+    import ImageFilter
+
+# Settings that can be overridden per task
+SETTINGS = ('max_side', 'draft', 'grayscale', 'binarize', 'block_size', 'offset', 'regions')
+
+
+def merge_settings(defaults: dict, overrides: dict = None) -> dict:
+    """ Apply preprocessing settings of task to default ones
+
+    :param defaults: Preprocessing config
+    :param overrides: Settings submitted with task
+    :return: Preprocessing settings
+    """
+    settings = {key: defaults[key] for key in SETTINGS}
+    settings.update({key: value for key, value in (overrides or {}).items() if key in SETTINGS})
+    return settings
+
+
+def open_image(image_file, settings: dict):
+    """ Open image, JPEG image is decoded at reduced scale if only smaller image is needed
+
+    :param image_file: File-like object with image
+    :param settings: Preprocessing settings
+    :return: Loaded PIL image
+    """
+    image = Image.open(image_file)
+    # Scale is reduced by DCT at decode time. It is not used with regions,
+    # small region of reduced image would be downscaled twice
+    if settings['draft'] and settings['max_side'] and not settings['regions']:
+        mode = 'L' if settings['grayscale'] or settings['binarize'] else 'RGB'
+        image.draft(mode, (settings['max_side'], settings['max_side']))
+    image.load()
+    return image
+
+
+def crop_regions(image, regions: list) -> list:
+    """ Crop regions of interest given as fractions of image size
+
+    :param image: PIL image
+    :param regions: List of [left, top, right, bottom] fractions
+    :return: List of cropped images, whole image if regions are not set
+    """
+    if not regions:
+        return [image]
+
+    width, height = image.size
+    boxes = [
+        (int(left * width), int(top * height), int(right * width), int(bottom * height))
+        for left, top, right, bottom in regions
+    ]
+    # narrow regions of small images are kept at least one pixel wide and high
+    return [
+        image.crop((left, top, max(right, left + 1), max(bottom, top + 1)))
+        for left, top, right, bottom in boxes
+    ]
+
+
+def downscale(image, max_side: int):
+    if not max_side or max(image.size) <= max_side:
+        return image
+
+    ratio = max_side / max(image.size)
+    size = (max(int(image.width * ratio), 1), max(int(image.height * ratio), 1))
+    return image.resize(size, Image.LANCZOS)
+
+
+def binarize(image, block_size: int, offset: int):
+    """ Adaptive binarization: pixel is text if it is darker than mean of
+    its ``block_size`` neighbourhood by more than ``offset``
+
+    :param image: Grayscale PIL image
+    :param block_size: Size of neighbourhood
+    :param offset: Brightness difference
+    :return: Black and white image
+    """
+    mean = image.filter(ImageFilter.BoxBlur(block_size // 2))
+    darker = ImageChops.subtract(mean, image)
+    return darker.point(lambda value: 0 if value > offset else 255)
+
+
+def preprocess(image, settings: dict) -> list:
+    """ Prepare decoded image for OCR. Runs inside OCR worker process.
+
+    :param image: PIL image
+    :param settings: Preprocessing settings
+    :return: List of images to recognize
+    """
+    images = []
+    for region in crop_regions(image, settings['regions']):
+        region = downscale(region, settings['max_side'])
+        if settings['grayscale'] or settings['binarize']:
+            region = region.convert('L')
+        if settings['binarize']:
+            region = binarize(region, settings['block_size'], settings['offset'])
+        images.append(region)
+    return images
@@ -0,0 +1,107 @@
+import aioredis
+import sqlalchemy as sa
+from aiohttp import web
+
+from api.db.tables import images
+from utils.logging import create_logger
+
+logger = create_logger(__name__)
+
+
+class ProcessedIndex:
+    """ Membership index of already processed products, one Redis set per user.
+
+    Index is only a fast pre-check before download and OCR, database
+    stays the source of truth for results.
+    """
+
+    def __init__(self, redis: aioredis.Redis, prefix: str):
+        self.redis = redis
+        self.prefix = prefix
+        self.lock = '{prefix}:rebuild'.format(prefix=prefix)
+
+    def key(self, user_id: int) -> str:
+        return '{prefix}:{user_id}'.format(prefix=self.prefix, user_id=user_id)
+
+    async def contains(self, user_id: int, product_id: str) -> bool:
+        """ Check if product of user was already processed
+
+        :param user_id: User id
+        :param product_id: Product id
+        :return: True if product was processed
+        """
+        return bool(await self.redis.sismember(self.key(user_id), product_id))
+
+    async def contains_many(self, user_id: int, product_ids: list) -> list:
+        """ Check if products of user were already processed in one round trip
+
+        :param user_id: User id
+        :param product_ids: Product ids
+        :return: List with flags in order of product ids
+        """
+        pipe = self.redis.pipeline()
+        for product_id in product_ids:
+            pipe.sismember(self.key(user_id), product_id)
+        return [bool(exists) for exists in await pipe.execute()]
+
+    async def add(self, user_id: int, *product_ids: str) -> None:
+        """ Mark products of user as processed
+
+        :param user_id: User id
+        :param product_ids: Product ids
+        :return:
+        """
+        await self.redis.sadd(self.key(user_id), *product_ids)
+
+    async def rebuild(self, engine, batch_size: int, lock_ttl: int) -> int:
+        """ Fill index from images table. Only one process rebuilds index
+        in ``lock_ttl`` seconds, others skip it.
+
+        :param engine: Database engine
+        :param batch_size: Count of rows read from db at once
+        :param lock_ttl: Seconds while index is considered fresh
+        :return: Count of indexed rows
+        """
+        locked = await self.redis.set(
+            self.lock, 1, expire=lock_ttl, exist=self.redis.SET_IF_NOT_EXIST
+        )
+        if not locked:
+            return 0
+
+        count, last_id = 0, 0
+        async with engine.acquire() as connection:
+            while True:
+                cursor = await connection.execute(
+                    sa.select([images.c.id, images.c.user_id, images.c.product_id])
+                        .where(images.c.id > last_id)
+                        .order_by(images.c.id)
+                        .limit(batch_size)
+                )
+                rows = await cursor.fetchall()
+                if not rows:
+                    break
+
+                pipe = self.redis.pipeline()
+                for row in rows:
+                    pipe.sadd(self.key(row['user_id']), row['product_id'])
+                await pipe.execute()
+
+                count += len(rows)
+                last_id = rows[-1]['id']
+
+        logger.info('Processed products index rebuilt with {count} rows'.format(count=count))
+        return count
+
+
+async def init_processed_index(app: web.Application) -> web.Application:
+    """ Initialize processed products index and rebuild it from database
+
+    :param app: Web application
+    :return: Web application
+    """
+    config = app['config']['processed']
+
+    app['processed'] = ProcessedIndex(app['create_redis'], config['prefix'])
+    await app['processed'].rebuild(app['db'], config['rebuild_batch'], config['rebuild_lock_ttl'])
+
+    return app
@@ -1,4 +1,4 @@
-import random
+import time
 
 try:
     from PIL import Image
@@ -6,28 +6,71 @@ except ImportError:
     import Image
 from io import BytesIO
 
-import pytesseract
+from api.ocr import image_to_string, image_to_data
+from api.preprocess import open_image, preprocess
 
 
-def check_image(body, text):
-    """ Function that read image body and check text on image
+def recognize_images(images: list, words: bool) -> dict:
+    """ Recognize prepared images of one picture
+
+    :param images: PIL images, regions of picture
+    :param words: Extract words with boxes and confidence
+    :return: Dict with text, words (None if not extracted) and mean confidence
+    """
+    if not words:
+        return {
+            'text': '\n'.join(image_to_string(image) for image in images),
+            'words': None,
+            'confidence': None,
+        }
+
+    texts, all_words, confidences = [], [], []
+    for region, image in enumerate(images):
+        text, region_words, confidence = image_to_data(image)
+        texts.append(text)
+        confidences.append(confidence)
+        for word in region_words:
+            # boxes are in coordinates of prepared region
+            word['region'] = region
+        all_words.extend(region_words)
+
+    return {
+        'text': '\n'.join(texts),
+        'words': all_words,
+        'confidence': round(sum(confidences) / len(confidences), 2),
+    }
+
+
+def ocr_image(body, settings=None, words=False):
+    """ Function that read image body, prepare it and recognize text on image with timings.
+    Runs inside OCR worker process.
 
     :param body: Image bytes body
-    :param text: Text that need to check on image
-    :return:
+    :param settings: Preprocessing settings, image is recognized as is if not set
+    :param words: Extract words with boxes and confidence
+    :return: Recognition result, image decode and preprocessing time
+        and recognition time in seconds
     """
-    image = Image.open(BytesIO(body))
-    picture_data = pytesseract.image_to_string(image)
+    started = time.perf_counter()
+    if settings is None:
+        images = [Image.open(BytesIO(body))]
+        images[0].load()
+    else:
+        images = preprocess(open_image(BytesIO(body), settings), settings)
+    decoded = time.perf_counter()
 
-    if text in picture_data:
-        return True
-    return False
+    result = recognize_images(images, words)
+
+    return result, decoded - started, time.perf_counter() - decoded
 
 
-def decode_value(value):
-    """ Function that decoded value to utf-8
+def check_text(picture_data, text):
+    """ Function that check text in recognized picture data
 
-    :param value: bytes value
+    :param picture_data: Recognized text
+    :param text: Text that need to check on image
     :return:
     """
-    return value.decode('utf-8')
+    if text in picture_data:
+        return True
+    return False
@@ -0,0 +1,293 @@
+import os
+import socket
+from typing import NamedTuple, Optional
+
+import aioredis
+import ujson
+from aiohttp import web
+
+from api.metrics import REDIS_COMMAND_SECONDS
+from utils.logging import create_logger
+
+logger = create_logger(__name__)
+
+# Store task bodies and append product keys to the stream only if the product is not queued yet.
+# Queued keys are also kept in set of their user, named by KEYS[3] prefix and user id of key.
+# ARGV holds pairs of key and body, script returns count of added products.
+ENQUEUE_SCRIPT = """
+local added = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1]) == 1 then
+        redis.call('XADD', KEYS[2], '*', 'key', ARGV[i])
+        redis.call('SADD', KEYS[3] .. ':' .. string.match(ARGV[i], '^[^:]*'), ARGV[i])
+        added = added + 1
+    end
+end
+return added
+"""
+
+# Remove task body and key from set of user queued keys
+REMOVE_SCRIPT = """
+if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('SREM', KEYS[3] .. ':' .. string.match(ARGV[1], '^[^:]*'), ARGV[1])
+return 1
+"""
+
+# Take over messages idle for ARGV[4] ms, or read new ones if there are no such messages,
+# and load their task bodies. Returns count of reclaimed messages followed by triples of
+# message id, key and body. Reclaimed messages that were deleted from the stream are acked.
+CLAIM_SCRIPT = """
+redis.replicate_commands()
+local messages = {}
+local reclaimed = 0
+local ids = {}
+for _, entry in ipairs(redis.call('XPENDING', KEYS[2], ARGV[1], '-', '+', ARGV[3])) do
+    if entry[3] >= tonumber(ARGV[4]) then
+        table.insert(ids, entry[1])
+    end
+end
+if #ids > 0 then
+    messages = redis.call('XCLAIM', KEYS[2], ARGV[1], ARGV[2], ARGV[4], unpack(ids))
+    reclaimed = #messages
+end
+if #messages == 0 then
+    local streams = redis.call('XREADGROUP', 'GROUP', ARGV[1], ARGV[2], 'COUNT', ARGV[3],
+                               'STREAMS', KEYS[2], '>')
+    if streams then
+        messages = streams[1][2]
+    end
+end
+local result = {reclaimed}
+for _, message in ipairs(messages) do
+    if message[2] then
+        local key = message[2][2]
+        table.insert(result, message[1])
+        table.insert(result, key)
+        table.insert(result, redis.call('HGET', KEYS[1], key))
+    else
+        redis.call('XACK', KEYS[2], ARGV[1], message[1])
+    end
+end
+return result
+"""
+
+# Acknowledge messages and drop task bodies. ARGV holds triples of message id, key and body.
+# If body was replaced while the task was processing - put the product key back
+# to the stream so the new body will be processed.
+ACK_SCRIPT = """
+for i = 2, #ARGV, 3 do
+    redis.call('XACK', KEYS[2], ARGV[1], ARGV[i])
+    redis.call('XDEL', KEYS[2], ARGV[i])
+    local body = redis.call('HGET', KEYS[1], ARGV[i + 1])
+    if body == ARGV[i + 2] then
+        redis.call('HDEL', KEYS[1], ARGV[i + 1])
+        redis.call('SREM', KEYS[3] .. ':' .. string.match(ARGV[i + 1], '^[^:]*'), ARGV[i + 1])
+    elseif body then
+        redis.call('XADD', KEYS[2], '*', 'key', ARGV[i + 1])
+    end
+end
+return 0
+"""
+
+
+class QueueItem(NamedTuple):
+    message_id: str
+    key: str
+    body: Optional[str]
+
+    @property
+    def data(self) -> dict:
+        return ujson.loads(self.body)
+
+
+def task_key(user_id: int, product_id: str) -> str:
+    """ Build queue key for product of specific user
+
+    :param user_id: User id
+    :param product_id: Product id
+    :return: Queue key
+    """
+    return '{user_id}:{product_id}'.format(user_id=user_id, product_id=product_id)
+
+
+def task_user_id(key: str) -> int:
+    """ Get user id from queue key
+
+    :param key: Queue key
+    :return: User id
+    """
+    return int(key.partition(':')[0])
+
+
+class TaskQueue:
+    """ Work queue built on Redis Stream with consumer group.
+
+    Stream holds only product keys, task bodies are stored in separate hash,
+    so product can be updated or removed from queue by key at any time.
+    Claimed messages stay in group pending list until acknowledged and are
+    redelivered to another consumer after ``claim_idle_ms`` of inactivity.
+    """
+
+    def __init__(self, redis: aioredis.Redis, stream: str, group: str, consumer: str,
+                 claim_idle_ms: int, batch_size: int):
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.tasks = '{stream}:tasks'.format(stream=stream)
+        self.user_keys = '{stream}:keys'.format(stream=stream)
+        self.claim_idle_ms = claim_idle_ms
+        self.batch_size = batch_size
+
+    async def setup(self) -> None:
+        """ Create consumer group (and stream) if it does not exist yet
+
+        :return:
+        """
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, latest_id='0', mkstream=True)
+        except aioredis.ReplyError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def enqueue(self, key: str, data: dict) -> bool:
+        """ Set task body and put product key to the queue
+
+        :param key: Queue key
+        :param data: Task body
+        :return: True if product was added to the queue, False if only body was updated
+        """
+        return await self.enqueue_many([(key, data)]) == 1
+
+    async def enqueue_many(self, tasks: list) -> int:
+        """ Set task bodies and put product keys to the queue in one round trip
+
+        :param tasks: List with (key, task body) pairs
+        :return: Count of products added to the queue, other products got only body updated
+        """
+        args = []
+        for key, data in tasks:
+            args.extend((key, ujson.dumps(data)))
+
+        with REDIS_COMMAND_SECONDS.time(command='enqueue'):
+            return await self.redis.eval(
+                ENQUEUE_SCRIPT, keys=[self.tasks, self.stream, self.user_keys], args=args
+            )
+
+    async def remove(self, key: str) -> bool:
+        """ Remove product from queue. Stream message without body is skipped by consumers.
+
+        :param key: Queue key
+        :return: True if product was in the queue
+        """
+        return bool(await self.redis.eval(
+            REMOVE_SCRIPT, keys=[self.tasks, self.stream, self.user_keys], args=[key]
+        ))
+
+    def _user_keys(self, user_id: int) -> str:
+        return '{prefix}:{user_id}'.format(prefix=self.user_keys, user_id=user_id)
+
+    async def keys(self, user_id: int) -> list:
+        """ Get queued keys of user. Should be used only for small queues, see ``count``.
+
+        :param user_id: User id
+        :return: List with keys
+        """
+        return await self.redis.smembers(self._user_keys(user_id), encoding='utf-8')
+
+    async def count(self, user_id: int) -> int:
+        """ Get count of queued products of user, including products in progress
+
+        :param user_id: User id
+        :return: Count of products
+        """
+        return await self.redis.scard(self._user_keys(user_id))
+
+    async def claim(self, count: int = None) -> list:
+        """ Take over messages abandoned by crashed or stuck consumers, or read new
+        messages from the stream if there are no such messages. Messages and their
+        task bodies are loaded in one round trip.
+
+        :param count: Max count of messages
+        :return: List with queue items
+        """
+        with REDIS_COMMAND_SECONDS.time(command='claim'):
+            reclaimed, *result = await self.redis.eval(
+                CLAIM_SCRIPT, keys=[self.tasks, self.stream],
+                args=[self.group, self.consumer, count or self.batch_size, self.claim_idle_ms]
+            )
+        if reclaimed:
+            logger.info('Reclaimed {count} abandoned tasks'.format(count=reclaimed))
+
+        return [
+            QueueItem(_decode(message_id), _decode(key), _decode(body))
+            for message_id, key, body in zip(result[::3], result[1::3], result[2::3])
+        ]
+
+    async def ack(self, item: QueueItem) -> None:
+        """ Mark queue item as processed
+
+        :param item: Queue item
+        :return:
+        """
+        await self.ack_many([item])
+
+    async def ack_many(self, items: list) -> None:
+        """ Mark queue items as processed in one round trip
+
+        :param items: List with queue items
+        :return:
+        """
+        args = [self.group]
+        for item in items:
+            args.extend((item.message_id, item.key, item.body or ''))
+
+        with REDIS_COMMAND_SECONDS.time(command='ack'):
+            await self.redis.eval(
+                ACK_SCRIPT, keys=[self.tasks, self.stream, self.user_keys], args=args
+            )
+
+    async def depth(self) -> dict:
+        """ Get queue depth. All used commands are O(1).
+
+        :return: Dict with total, in progress and waiting messages count
+        """
+        transaction = self.redis.multi_exec()
+        transaction.xlen(self.stream)
+        transaction.xpending(self.stream, self.group)
+        transaction.hlen(self.tasks)
+        total, (in_progress, *_), products = await transaction.execute()
+
+        return {
+            'total': total,
+            'in_progress': in_progress,
+            'waiting': total - in_progress,
+            'products': products,
+        }
+
+
+def _decode(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+async def queue(app: web.Application) -> None:
+    """ Create work queue on top of redis connection
+
+    :param app: Web application
+    :return:
+    """
+    config = app['config']['queue']
+
+    app['queue'] = TaskQueue(
+        app['create_redis'],
+        stream=config['stream'],
+        group=config['group'],
+        consumer='{host}-{pid}'.format(host=socket.gethostname(), pid=os.getpid()),
+        claim_idle_ms=config['claim_idle_ms'],
+        batch_size=config['batch_size'],
+    )
+    await app['queue'].setup()
+
+    yield
@@ -5,9 +5,15 @@ from aiohttp import web
 from api.auth.handlers import register_user, login_user
 from api.handlers import (
     get_urls_for_recognition, post_urls_for_recognition, delete_urls_for_recognition,
+    post_urls_batch_for_recognition,
     start_processing_images,
+    get_job,
     get_all_running_tasks_count,
-    get_json_result)
+    get_json_result,
+    export_results,
+    search_products,
+    get_metrics,
+    profile_process)
 
 PROJECT_PATH = pathlib.Path(__file__).parent
 
@@ -22,10 +28,12 @@ def init_routes(app: web.Application):
 
     router.add_get('/api/v1/urls', get_urls_for_recognition, name='get-urls')
     router.add_post('/api/v1/urls', post_urls_for_recognition, name='post-urls')
+    router.add_post('/api/v1/urls/batch', post_urls_batch_for_recognition, name='post-urls-batch')
     router.add_delete('/api/v1/urls/{product_id}', delete_urls_for_recognition, name='delete-urls')
 
     router.add_get('/api/v1/urls/start_processing', start_processing_images, name='start-processing')
 
+    router.add_get('/api/v1/jobs/{job_id}', get_job, name='get-job')
     router.add_get('/api/v1/tasks', get_all_running_tasks_count, name='get-tasks')
 
     # Auth routs
@@ -34,3 +42,9 @@ def init_routes(app: web.Application):
 
     # Results
     router.add_get('/api/v1/results', get_json_result, name='results')
+    router.add_get('/api/v1/results/export', export_results, name='results-export')
+    router.add_get('/api/v1/search', search_products, name='search')
+
+    # Monitoring
+    router.add_get('/metrics', get_metrics, name='metrics')
+    router.add_get('/api/v1/admin/profile', profile_process, name='admin-profile')
@@ -1,12 +1,42 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate, validates, ValidationError
+
+from api.matching import MODES
 
 
 class ProductIdSchema(Schema):
     product_id = fields.String(required=True)
 
 
+class PreprocessSchema(Schema):
+    max_side = fields.Integer(validate=validate.Range(min=0))
+    draft = fields.Boolean()
+    grayscale = fields.Boolean()
+    binarize = fields.Boolean()
+    block_size = fields.Integer(validate=validate.Range(min=3))
+    offset = fields.Integer(validate=validate.Range(min=0, max=255))
+    regions = fields.List(fields.List(fields.Float(validate=validate.Range(min=0, max=1)),
+                                      validate=validate.Length(equal=4)))
+
+    @validates('regions')
+    def validate_regions(self, regions: list) -> None:
+        for left, top, right, bottom in regions:
+            if left >= right or top >= bottom:
+                raise ValidationError('Region must have left less than right '
+                                      'and top less than bottom')
+
+
+class MatchSchema(Schema):
+    mode = fields.String(validate=validate.OneOf(MODES))
+    max_distance = fields.Integer(validate=validate.Range(min=0))
+
+
 class UrlsDataSchema(ProductIdSchema):
     images_urls = fields.List(fields.URL, required=True)
+    image_text = fields.String(required=True)
+    phrases = fields.List(fields.String(validate=validate.Length(min=1)), missing=None)
+    force = fields.Boolean(missing=False)
+    preprocess = fields.Nested(PreprocessSchema, missing=None)
+    match = fields.Nested(MatchSchema, missing=None)
 
 
 class UserLoginSchema(Schema):
@@ -1,84 +1,226 @@
 import asyncio
-from concurrent.futures.thread import ThreadPoolExecutor
+from concurrent.futures import Executor
 
 import aiohttp
 from aiohttp import web
 
-from api.db.db_helpers import check_exist
-from api.db.tables import images
-from api.processing import check_image, decode_value
+from api.cache import OCRCache
+from api.db.db_helpers import NOT_FOUND_URL
+from api.jobs import JobProgress
+from api.metrics import (
+    IMAGE_DOWNLOAD_SECONDS, IMAGE_DOWNLOAD_BYTES, IMAGE_DECODE_SECONDS, OCR_SECONDS, PRODUCTS,
+    OCR_IN_FLIGHT)
+from api.matching import Matcher
+from api.preprocess import merge_settings
+from api.processing import ocr_image
+from api.tracing import span, add_span
 from utils.logging import create_logger
 
 logger = create_logger(__name__)
 
 
-async def load_image_content(executor: ThreadPoolExecutor, session: aiohttp.ClientSession,
-                             image_urls: list, image_text: str) -> tuple:
-    """ Function that read content of image and run blocking sync processing of image
+async def recognize(executor: Executor, cache: OCRCache, body: bytes, settings: dict) -> dict:
+    """ Function that recognize text on image, repeated images are taken from cache
 
-    :param executor: ThreadPoolExecutor for run sync code in threads
+    :param executor: Executor for run sync code in OCR worker processes
+    :param cache: OCR result cache
+    :param body: Image bytes body
+    :param settings: Recognition settings: preprocessing settings and words extraction flag
+    :return: Recognition result with text, words and confidence
+    """
+    key = cache.key(body, settings)
+    with span('cache_get') as cache_span:
+        result = await cache.get(key)
+        if cache_span is not None:
+            cache_span.attributes['hit'] = result is not None
+
+    if result is None:
+        loop = asyncio.get_running_loop()
+        with span('ocr'), OCR_IN_FLIGHT.track():
+            result, decode_time, ocr_time = await loop.run_in_executor(
+                executor, ocr_image, body, settings['preprocess'], settings['words'])
+            # Worker reports only durations, so spans are placed right before the result
+            add_span('tesseract', ocr_time)
+            add_span('decode', decode_time, offset=ocr_time)
+        IMAGE_DECODE_SECONDS.observe(decode_time)
+        OCR_SECONDS.observe(ocr_time)
+        with span('cache_set'):
+            await cache.set(key, result)
+    return result
+
+
+async def check_image_url(executor: Executor, cache: OCRCache, session: aiohttp.ClientSession,
+                          semaphore: asyncio.Semaphore, url: str, matcher: Matcher,
+                          settings: dict, texts: dict, progress: JobProgress) -> frozenset:
+    """ Function that download single image and check phrases on it
+
+    :param executor: Executor for run sync code in OCR worker processes
+    :param cache: OCR result cache
+    :param session: Client Session for every
+    :param semaphore: Semaphore that limits images processed at once
+    :param url: Image url
+    :param matcher: Matcher of phrases for checking on image
+    :param settings: Recognition settings
+    :param texts: Dict where recognition result is stored by image url
+    :param progress: Progress counters of job
+    :return: Indexes of phrases found on the image
+    """
+    with span('image', url=url) as image_span:
+        async with semaphore:
+            with progress.stage('downloading'), IMAGE_DOWNLOAD_SECONDS.time():
+                with span('http_get') as get_span:
+                    response = await session.get(url)
+                    if get_span is not None:
+                        get_span.attributes['status'] = response.status
+                async with response:
+                    with span('http_read'):
+                        content = await response.read()
+            IMAGE_DOWNLOAD_BYTES.observe(len(content))
+            with progress.stage('recognizing'):
+                texts[url] = await recognize(executor, cache, content, settings)
+            if matcher.cpu_bound:
+                loop = asyncio.get_running_loop()
+                with span('match'):
+                    matched = await loop.run_in_executor(executor, matcher.match,
+                                                         texts[url]['text'])
+            else:
+                matched = matcher.match(texts[url]['text'])
+            if image_span is not None:
+                image_span.attributes.update(bytes=len(content), matched=len(matched))
+            return matched
+
+
+async def load_image_content(executor: Executor, cache: OCRCache,
+                             session: aiohttp.ClientSession, image_urls: list, matcher: Matcher,
+                             settings: dict, texts: dict, concurrency: int,
+                             progress: JobProgress, all_images: bool = False) -> list:
+    """ Function that concurrently read content of images and run blocking sync processing
+    of images. Remaining downloads and OCR jobs are cancelled as soon as all phrases
+    are resolved unless ``all_images`` is set, result of every phrase is always
+    the first matched url in list order. Failed image fails the product only if
+    the first (primary) phrase is not resolved yet, otherwise it matches no phrase.
+
+    :param executor: Executor for run sync code in OCR worker processes
+    :param cache: OCR result cache
     :param session: Client Session for every
     :param image_urls: List with image urls
-    :param image_text: Text for checking on image
-    :return: result (True if text was found on the image else False), url (Image url)
+    :param matcher: Matcher of phrases for checking on image
+    :param settings: Recognition settings
+    :param texts: Dict where recognition results of checked images are stored by url
+    :param concurrency: Max count of images processed at once
+    :param progress: Progress counters of job
+    :param all_images: Recognize all images even after all phrases are resolved,
+        failures of such images are ignored
+    :return: List with the first url where phrase was found, or None, for every phrase
     """
-    loop = asyncio.get_running_loop()
-    for url in image_urls:
-        async with session.get(url) as response:
-            content = await response.read()
-            result = await loop.run_in_executor(executor, check_image, content, image_text)
-            if result:
-                return result, url
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        asyncio.ensure_future(
+            check_image_url(executor, cache, session, semaphore, url, matcher, settings,
+                            texts, progress)
+        )
+        for url in image_urls
+    ]
+    matches = [None] * len(matcher.phrases)
+    unresolved = set(range(len(matcher.phrases)))
+    next_index = 0
+    try:
+        pending = set(tasks)
+        while pending and (unresolved or all_images):
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            # Images before the first match must be checked, so move only over finished prefix
+            while unresolved and next_index < len(tasks) and tasks[next_index].done():
+                try:
+                    found = tasks[next_index].result()
+                except Exception:
+                    if 0 in unresolved:
+                        raise
+                    logger.exception('Image {url} failed, other phrases are not checked on it'
+                                     .format(url=image_urls[next_index]))
+                    found = frozenset()
+                for phrase in found & unresolved:
+                    matches[phrase] = image_urls[next_index]
+                    unresolved.discard(phrase)
+                next_index += 1
+        return matches
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
-async def async_image_process(request: web.Request, product_id: bytes, image_urls: list,
-                              image_text: str) -> None:
+async def async_image_process(app: web.Application, product_id: str, user_id: int,
+                              image_urls: list, image_text: str, force: bool = False,
+                              progress: JobProgress = None, preprocess: dict = None,
+                              phrases: list = None, match: dict = None) -> None:
     """ Function that run task for each product_id and set result to storage
 
-    :param request: Aiohttp Request instance
+    :param app: Web application
     :param product_id: Product id
+    :param user_id: Id of user who created the task
     :param image_urls: List with images links
     :param image_text: Text for checking on image
+    :param force: Overwrite result if product was already processed
+    :param progress: Progress counters of job
+    :param preprocess: Preprocessing settings of task that override config
+    :param phrases: All phrases for checking on image, the first one is ``image_text``
+    :param match: Matching settings of task that override config
     :return:
     """
-    executor = request.app['executor']
-    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-        product_id = decode_value(product_id).split(':')[0]
-        data = await load_image_content(executor, session, image_urls, image_text)
+    progress = progress or JobProgress(app['jobs'], None)
+    texts_config = app['config']['texts']
+    settings = {
+        'preprocess': merge_settings(app['config']['preprocess'], preprocess),
+        'words': texts_config['enabled'] and texts_config['words'],
+    }
+    texts = {}
+    matcher = Matcher(phrases or [image_text], **dict(app['config']['matching'], **(match or {})))
+    executor = app['executor']
+    cache = app['ocr_cache']
+    session = app['http_session']
+    concurrency = app['config']['processing']['images_concurrency']
 
-        logger.info('Received result from id: {id}'.format(id=product_id))
+    with app['tracer'].trace('product', product_id=product_id, user_id=user_id,
+                             images=len(image_urls)) as root:
+        with span('load_images'):
+            matches = await load_image_content(
+                executor, cache, session, image_urls, matcher, settings, texts, concurrency,
+                progress, all_images=texts_config['enabled'] and texts_config['all_images']
+            )
 
-        if data:
-            result, url = data
+        if root is not None:
+            logger.info('Received result from id: {id}, trace: {trace}'.format(
+                id=product_id, trace=root.trace.trace_id))
         else:
-            result, url = None, None
-
-        async with request.app['db'].acquire() as connection:
-            value_exist = await check_exist(connection, images, 'product_id', product_id)
-            if not value_exist:
-                if result:
-                    await connection.execute(
-                        images.insert().values(
-                            product_id=product_id,
-                            image_url=url,
-                            user_id=request.app['user']['id'],
-                            image_text=image_text
-                        )
-                    )
-                    logger.info('Successfully pushed to DB data with ID: {id}, URL: {url}'.format(
-                        id=product_id, url=url))
-
-                else:
-                    await connection.execute(
-                        images.insert().values(
-                            product_id=product_id,
-                            image_url='n/a',
-                            user_id=request.app['user']['id'],
-                            image_text=image_text
-                        )
-                    )
-                    logger.info('Text on images not found. Pushed empty data with ID: {id}'.format(
-                        id=product_id))
-            else:
-                logger.info('Record with ID: {id} already exist in DB'.format(
-                    id=product_id))
+            logger.info('Received result from id: {id}'.format(id=product_id))
+
+        # product is matched by primary phrase, other phrases are reported in phrases column
+        url = matches[0]
+        result = url is not None
+
+        row = {
+            'product_id': product_id,
+            'image_url': url or NOT_FOUND_URL,
+            'user_id': user_id,
+            'image_text': image_text,
+            'phrases': [
+                {'phrase': phrase, 'image_url': phrase_url}
+                for phrase, phrase_url in zip(matcher.phrases, matches)
+            ],
+        }
+        text_rows = [
+            dict(texts[url], user_id=user_id, product_id=product_id, image_url=url)
+            for url in image_urls if url in texts
+        ] if texts_config['enabled'] else []
+        with span('db_write', force=force):
+            await app['writer'].write(row, force, text_rows)
+    progress.incr('matched' if result else 'not_matched')
+    PRODUCTS.inc(result='matched' if result else 'not_matched')
+
+    if result:
+        logger.info('Successfully pushed to DB data with ID: {id}, URL: {url}'.format(
+            id=product_id, url=url))
+    else:
+        logger.info('Text on images not found. Pushed empty data with ID: {id}'.format(
+            id=product_id))
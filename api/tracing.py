@@ -0,0 +1,196 @@
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+import ujson
+from aiohttp import web
+
+from utils.logging import create_logger
+
+logger = create_logger(__name__)
+
+SERVICE_NAME = 'recognition-platform'
+
+# Span of current task, child tasks inherit it with context
+_current_span = ContextVar('current_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], attributes: dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': [
+                {'key': key, 'value': {'stringValue': str(value)}}
+                for key, value in self.attributes.items()
+            ],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """ Record span as child of current span. Does nothing if current task is not traced.
+
+    :param name: Span name
+    :param attributes: Span attributes
+    :return: Span or None
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    current = Span(parent.trace, name, parent.span_id, attributes)
+    parent.trace.spans.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.end = time.time_ns()
+        _current_span.reset(token)
+
+
+def add_span(name: str, duration: float, offset: float = 0, **attributes) -> None:
+    """ Record finished span of work done outside of current process,
+    e.g. in OCR worker. Span ends ``offset`` seconds before the current moment.
+
+    :param name: Span name
+    :param duration: Duration in seconds
+    :param offset: Seconds between span end and the current moment
+    :param attributes: Span attributes
+    :return:
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return
+
+    recorded = Span(parent.trace, name, parent.span_id, attributes)
+    recorded.end = time.time_ns() - int(offset * 1e9)
+    recorded.start = recorded.end - int(duration * 1e9)
+    parent.trace.spans.append(recorded)
+
+
+class Tracer:
+    """ Starts traces of sampled products, writes finished traces to file
+    in OTLP JSON format (one export request per line) and logs slow ones.
+    """
+
+    def __init__(self, sample_rate: float, export_path: str, slow_threshold: float):
+        self.sample_rate = sample_rate
+        self.export_path = export_path
+        self.slow_threshold = slow_threshold
+        self._file = open(export_path, 'a') if export_path else None
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """ Start trace with root span if product is sampled
+
+        :param name: Root span name
+        :param attributes: Root span attributes
+        :return: Root span or None
+        """
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            yield None
+            return
+
+        trace = Trace()
+        root = Span(trace, name, None, attributes)
+        trace.spans.append(root)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = repr(e)
+            raise
+        finally:
+            root.end = time.time_ns()
+            _current_span.reset(token)
+            self.finish(trace, root)
+
+    def finish(self, trace: Trace, root: Span) -> None:
+        if root.duration >= self.slow_threshold:
+            logger.info('Slow {name} {attributes} {duration:.2f}s, trace {id}: {spans}'.format(
+                name=root.name, attributes=root.attributes, duration=root.duration,
+                id=trace.trace_id,
+                spans=', '.join('{}={:.3f}s'.format(s.name, s.duration) for s in trace.spans[1:])
+            ))
+
+        if self._file is not None:
+            self._file.write(ujson.dumps(to_otlp(trace)) + '\n')
+            self._file.flush()
+
+
+def to_otlp(trace: Trace) -> dict:
+    return {
+        'resourceSpans': [{
+            'resource': {
+                'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}},
+                    {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}},
+                ],
+            },
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [s.to_otlp() for s in trace.spans],
+            }],
+        }],
+    }
+
+
+async def tracer(app: web.Application) -> None:
+    """ Create tracer and close export file after application stops
+
+    :param app: Web application
+    :return:
+    """
+    config = app['config']['tracing']
+
+    app['tracer'] = Tracer(
+        sample_rate=config['sample_rate'],
+        export_path=config['export_path'],
+        slow_threshold=config['slow_threshold'],
+    )
+
+    yield
+
+    app['tracer'].close()
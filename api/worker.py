@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+import signal
+
+from aiohttp import web
+
+from api.app import init_processing
+from utils.common import init_config
+from utils.logging import create_logger
+
+try:
+    import uvloop
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    print('Library uvloop is not available')
+
+logger = create_logger(__name__)
+
+
+def init_worker(config=None) -> web.Application:
+    """ Initialize application without HTTP routes that only processes the work queue
+
+    :param config: Path to config file
+    :return: Web application
+    """
+    app = web.Application()
+
+    init_config(app, config)
+
+    init_processing(app, dispatch=True)
+
+    return app
+
+
+async def run_worker(config=None) -> None:
+    """ Run worker until SIGTERM or SIGINT, then drain claimed products and close connections
+
+    :param config: Path to config file
+    :return:
+    """
+    app = init_worker(config)
+    runner = web.AppRunner(app, handle_signals=False)
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await runner.setup()
+    logger.info('Worker {name} started'.format(name=app['queue'].consumer))
+    try:
+        await stop.wait()
+        logger.info('Worker {name} is stopping'.format(name=app['queue'].consumer))
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    """
+    Entry point for standalone worker: python -m api.worker -c config/dev.yml
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Image recognition worker')
+    parser.add_argument('-c', '--config', help='Path to config file')
+    args = parser.parse_args()
+
+    asyncio.run(run_worker(args.config))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import asyncio
+import random
+from functools import lru_cache
+from io import BytesIO
+from typing import NamedTuple, Optional
+
+from aiohttp import web
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    import Image
+    import ImageDraw
+    import ImageFont
+
+WORDS = (
+    'SALE', 'ORGANIC', 'PREMIUM', 'FRESH', 'LIMITED', 'CLASSIC', 'NATURAL', 'ORIGINAL',
+    'EXTRA', 'DELUXE', 'SPECIAL', 'BONUS',
+)
+FONTS = (
+    'DejaVuSans-Bold.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    'Arial Bold.ttf',
+)
+
+
+@lru_cache(maxsize=64)
+def load_font(size: int):
+    """ Load scalable font, bitmap default font is used if no font is installed
+
+    :param size: Font size in pixels
+    :return: Font
+    """
+    for font in FONTS:
+        try:
+            return ImageFont.truetype(font, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def text_size(draw, text: str, font) -> tuple:
+    if hasattr(draw, 'textbbox'):
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        return right - left, bottom - top
+    return draw.textsize(text, font=font)
+
+
+def render_image(text: str, width: int, height: int, seed: str, image_format: str = 'JPEG',
+                 quality: int = 85) -> bytes:
+    """ Render product-like picture with text at random position over random shapes
+
+    :param text: Text on image, empty string for image without text
+    :param width: Image width
+    :param height: Image height
+    :param seed: Seed of random background and text position
+    :param image_format: Pillow image format
+    :param quality: JPEG quality
+    :return: Encoded image
+    """
+    rng = random.Random(seed)
+    background = rng.randint(200, 255)
+    image = Image.new('RGB', (width, height), (background, background, background))
+    draw = ImageDraw.Draw(image)
+
+    for _ in range(8):
+        x, y = rng.randrange(width), rng.randrange(height)
+        box = [x, y, x + rng.randrange(width // 2 + 1), y + rng.randrange(height // 2 + 1)]
+        draw.rectangle(box, fill=tuple(rng.randint(150, 255) for _ in range(3)))
+
+    if text:
+        font = load_font(max(min(width // (len(text) + 2), height // 8), 12))
+        text_width, text_height = text_size(draw, text, font)
+        x = rng.randint(0, max(width - text_width, 0))
+        y = rng.randint(0, max(height - text_height, 0))
+        shade = rng.randint(0, 60)
+        draw.text((x, y), text, fill=(shade, shade, shade), font=font)
+
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=quality)
+    return buffer.getvalue()
+
+
+class ImageSpec(NamedTuple):
+    text: str
+    target: bool
+    error: bool
+    latency: float
+
+
+class Scenario:
+    """ Deterministic set of products. Product has ``images`` images, text of the task
+    is on one of them with ``match_rate`` probability, other images have another word.
+    Images fail with ``error_rate`` probability and are served with ``latency`` ± ``jitter``.
+    """
+
+    def __init__(self, products: int, images: int, width: int, height: int, match_rate: float,
+                 error_rate: float, latency: float, jitter: float, seed: int):
+        self.products = products
+        self.images = images
+        self.width = width
+        self.height = height
+        self.match_rate = match_rate
+        self.error_rate = error_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+
+    def product_id(self, product: int) -> str:
+        return 'bench-{product}'.format(product=product)
+
+    def text(self, product: int) -> str:
+        return WORDS[product % len(WORDS)]
+
+    def target(self, product: int) -> Optional[int]:
+        """ Index of image with text of the task
+
+        :param product: Product number
+        :return: Image index or None if text is not on images
+        """
+        rng = random.Random('{}:{}'.format(self.seed, product))
+        if rng.random() >= self.match_rate:
+            return None
+        return rng.randrange(self.images)
+
+    def image(self, product: int, index: int) -> ImageSpec:
+        rng = random.Random('{}:{}:{}'.format(self.seed, product, index))
+        target = self.target(product) == index
+        text = self.text(product) if target else WORDS[(product + 1 + index) % len(WORDS)]
+        latency = max(self.latency + rng.uniform(-self.jitter, self.jitter), 0)
+        return ImageSpec(text, target, rng.random() < self.error_rate, latency)
+
+    def expected(self, product: int) -> tuple:
+        """ Result that should be stored by the service. Images are checked in list order
+        and failed image fails the whole product, unless text was found before it.
+
+        :param product: Product number
+        :return: Result (matched, not_matched or failed) and index of matched image
+        """
+        for index in range(self.images):
+            spec = self.image(product, index)
+            if spec.error:
+                return 'failed', None
+            if spec.target:
+                return 'matched', index
+        return 'not_matched', None
+
+    def body(self, product: int, index: int) -> bytes:
+        return render_image(self.image(product, index).text, self.width, self.height,
+                            seed='{}:{}:{}'.format(self.seed, product, index))
+
+
+def create_image_app(scenario: Scenario) -> web.Application:
+    """ Create application that serves images of the scenario by
+    ``/images/{product}/{index}.jpg`` urls
+
+    :param scenario: Benchmark scenario
+    :return: Web application
+    """
+    body = lru_cache(maxsize=4096)(scenario.body)
+
+    async def get_image(request: web.Request) -> web.Response:
+        product, index = int(request.match_info['product']), int(request.match_info['index'])
+        spec = scenario.image(product, index)
+        await asyncio.sleep(spec.latency)
+        if spec.error:
+            return web.Response(status=500, text='Generated error')
+        return web.Response(body=body(product, index), content_type='image/jpeg')
+
+    app = web.Application()
+    app.router.add_get(r'/images/{product:\d+}/{index:\d+}.jpg', get_image)
+    return app
+
+
+def serve_images(scenario: Scenario, host: str, port: int) -> None:
+    """ Run image server, target of separate process
+
+    :param scenario: Benchmark scenario
+    :param host: Host
+    :param port: Port
+    :return:
+    """
+    web.run_app(create_image_app(scenario), host=host, port=port, print=None, access_log=None)
@@ -0,0 +1,251 @@
+""" OCR micro-benchmark of tesseract settings and image preprocessing.
+
+Every variant recognizes the same corpus in fresh OCR worker process,
+accuracy of ``check_text`` decisions is compared with per-image latency and worker memory.
+Corpus is generated and/or read from directory with ``labels.csv`` (file,text[,expected]
+columns, expected is 1 if text is on image and 0 otherwise).
+
+    python -m benchmarks.ocr --synthetic 100 --corpus ~/images --profile config/ocr-profile.yml
+
+Recommended variant is saved as profile that is loaded by service with ``ocr.profile`` option.
+"""
+import argparse
+import csv
+import itertools
+import random
+import resource
+import string
+import sys
+import time
+from concurrent.futures.process import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from typing import NamedTuple
+
+import ujson
+import yaml
+
+from api.ocr import init_worker, image_to_string, ENGINE_SETTINGS
+from api.preprocess import SETTINGS as PREPROCESS_SETTINGS, open_image, preprocess
+from api.processing import check_text
+from benchmarks.images import WORDS, render_image
+from benchmarks.pipeline import RESULTS_PATH, git_revision, summarize
+
+BASELINE = {
+    'psm': 3, 'oem': 3, 'dpi': 0, 'whitelist': '',
+    'max_side': 0, 'draft': True, 'grayscale': False, 'binarize': False,
+    'block_size': 31, 'offset': 10, 'regions': [],
+}
+SWEEP = {
+    'psm': (3, 6, 11),
+    'oem': (1, 3),
+    'dpi': (0, 300),
+    'whitelist': ('', string.ascii_uppercase),
+    'max_side': (0, 2000, 1200, 800),
+    'grayscale': (False, True),
+    'binarize': (False, True),
+}
+
+
+class Sample(NamedTuple):
+    name: str
+    body: bytes
+    query: str
+    expected: bool
+
+
+def synthetic_corpus(count: int, width: int, height: int, seed: int) -> list:
+    """ Generate images with one word, half of samples check the word on image
+    and other half check another word
+
+    :param count: Count of samples
+    :param width: Base image width, images are from half to double size
+    :param height: Base image height
+    :param seed: Random seed
+    :return: List of samples
+    """
+    rng = random.Random(seed)
+    samples = []
+    for index in range(count):
+        text = rng.choice(WORDS)
+        factor = rng.choice((0.5, 1, 2))
+        body = render_image(text, int(width * factor), int(height * factor),
+                            seed='{}:{}'.format(seed, index))
+        expected = index % 2 == 0
+        query = text if expected else rng.choice([word for word in WORDS if word != text])
+        samples.append(Sample('synthetic-{}'.format(index), body, query, expected))
+    return samples
+
+
+def load_corpus(path: Path) -> list:
+    """ Read real images with ground truth from labels.csv of directory
+
+    :param path: Corpus directory
+    :return: List of samples
+    """
+    samples = []
+    with open(path / 'labels.csv', newline='') as file:
+        for row in csv.DictReader(file):
+            samples.append(Sample(
+                row['file'], (path / row['file']).read_bytes(), row['text'],
+                row.get('expected', '1') != '0',
+            ))
+    return samples
+
+
+def recognize_sample(body: bytes, variant: dict) -> tuple:
+    """ Recognize image in OCR worker process
+
+    :param body: Image bytes body
+    :param variant: Variant settings
+    :return: Text, decode and preprocessing time, OCR time, peak RSS of worker in MB
+    """
+    started = time.perf_counter()
+    images = preprocess(open_image(BytesIO(body), variant), variant)
+    prepared = time.perf_counter()
+
+    text = '\n'.join(image_to_string(image) for image in images)
+    finished = time.perf_counter()
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+    return text, prepared - started, finished - prepared, rss
+
+
+def evaluate(variant: dict, samples: list, lang: str) -> dict:
+    """ Recognize corpus with variant in fresh worker process
+
+    :param variant: Variant settings
+    :param samples: Corpus
+    :param lang: Tesseract language
+    :return: Dict with accuracy, latency and memory
+    """
+    settings = dict({key: variant[key] for key in ENGINE_SETTINGS if key != 'lang'}, lang=lang)
+    correct, prepare, ocr, total, rss = 0, [], [], [], 0
+
+    with ProcessPoolExecutor(max_workers=1, initializer=init_worker,
+                             initargs=(settings,)) as executor:
+        # first image loads language data
+        executor.submit(recognize_sample, samples[0].body, variant).result()
+
+        for sample in samples:
+            text, prepare_time, ocr_time, rss = executor.submit(
+                recognize_sample, sample.body, variant).result()
+            correct += check_text(text, sample.query) == sample.expected
+            prepare.append(prepare_time)
+            ocr.append(ocr_time)
+            total.append(prepare_time + ocr_time)
+
+    return {
+        'variant': variant,
+        'accuracy': round(correct / len(samples), 4),
+        'prepare_seconds': summarize(prepare),
+        'ocr_seconds': summarize(ocr),
+        'total_seconds': summarize(total),
+        'peak_rss_mb': round(rss, 1),
+    }
+
+
+def create_variants(grid: bool) -> list:
+    """ Variants that change one setting of baseline at once, or all combinations
+
+    :param grid: Build all combinations of settings
+    :return: List of variants
+    """
+    if grid:
+        return [dict(BASELINE, **dict(zip(SWEEP, values)))
+                for values in itertools.product(*SWEEP.values())]
+
+    variants = [dict(BASELINE)]
+    for key, values in SWEEP.items():
+        variants.extend(dict(BASELINE, **{key: value}) for value in values
+                        if value != BASELINE[key])
+    return variants
+
+
+def recommend(results: list, tolerance: float) -> dict:
+    """ Fastest variant of ones with accuracy close to the best
+
+    :param results: Evaluated variants
+    :param tolerance: Allowed accuracy loss
+    :return: Recommended variant result
+    """
+    best = max(result['accuracy'] for result in results)
+    candidates = [result for result in results if result['accuracy'] >= best - tolerance]
+    return min(candidates, key=lambda result: result['total_seconds']['p50'])
+
+
+def write_profile(path: Path, result: dict) -> None:
+    variant = result['variant']
+    profile = {
+        'ocr': {key: variant[key] for key in ENGINE_SETTINGS if key != 'lang'},
+        'preprocess': {key: variant[key] for key in PREPROCESS_SETTINGS},
+    }
+    header = (
+        '# Made by benchmarks/ocr.py at {date} on {revision}\n'
+        '# accuracy: {accuracy}, p50: {p50}s, p90: {p90}s\n'
+    ).format(date=datetime.utcnow().isoformat(timespec='seconds'), revision=git_revision(),
+             accuracy=result['accuracy'], **result['total_seconds'])
+    path.write_text(header + yaml.safe_dump(profile, default_flow_style=False))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='OCR settings benchmark')
+    parser.add_argument('--synthetic', type=int, default=60, help='Count of generated images')
+    parser.add_argument('--width', type=int, default=1200)
+    parser.add_argument('--height', type=int, default=900)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--corpus', help='Directory with real images and labels.csv')
+    parser.add_argument('--lang', default='eng')
+    parser.add_argument('--grid', action='store_true',
+                        help='Evaluate all combinations instead of one setting at once')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='Accuracy that can be lost for faster variant')
+    parser.add_argument('-o', '--output', help='Result file, benchmarks/results/ by default')
+    parser.add_argument('--profile', help='File for recommended profile')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    samples = synthetic_corpus(args.synthetic, args.width, args.height, args.seed)
+    if args.corpus:
+        samples.extend(load_corpus(Path(args.corpus)))
+    if not samples:
+        sys.exit('Corpus is empty')
+
+    results = []
+    for variant in create_variants(args.grid):
+        result = evaluate(variant, samples, args.lang)
+        results.append(result)
+        print('{variant}: accuracy={accuracy} p50={p50}s p90={p90}s rss={rss}MB'.format(
+            variant=' '.join('{}={!r}'.format(key, value) for key, value in variant.items()),
+            accuracy=result['accuracy'], rss=result['peak_rss_mb'], **result['total_seconds']))
+
+    recommended = recommend(results, args.tolerance)
+    report = {
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(),
+        'samples': len(samples),
+        'lang': args.lang,
+        'results': results,
+        'recommended': recommended,
+    }
+
+    output = Path(args.output) if args.output else RESULTS_PATH / 'ocr-{}.json'.format(
+        datetime.utcnow().strftime('%Y%m%d-%H%M%S'))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(ujson.dumps(report, indent=2))
+    print('Recommended: {}'.format(recommended['variant']))
+    print('Saved to {}'.format(output))
+
+    if args.profile:
+        write_profile(Path(args.profile), recommended)
+        print('Profile saved to {}'.format(args.profile))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+""" End-to-end benchmark of the processing pipeline.
+
+Runs local image server with generated images in separate process, API with dispatcher
+in this process and drives real ingest -> start_processing -> results path over HTTP.
+Local Redis and Postgres from config are used, see config/bench.yml.
+
+    CONFIG_FILE=bench.yml alembic upgrade head
+    python -m benchmarks.pipeline --products 500 --images 4 --latency 0.05
+
+Result is saved as JSON, ``--baseline`` compares it with result of previous run.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import aiohttp
+import aioredis
+import ujson
+from aiohttp import web
+
+from api.app import init_app
+from benchmarks.images import Scenario, serve_images
+from utils.common import PROJECT_PATH, get_config
+
+BENCH_CONFIG_PATH = PROJECT_PATH / 'config' / 'bench.yml'
+RESULTS_PATH = PROJECT_PATH / 'benchmarks' / 'results'
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values: list, percent: float) -> float:
+    """ Nearest-rank percentile of sorted values """
+    index = max(int(round(percent / 100 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    summary = {'count': len(values), 'max': round(values[-1], 4)}
+    for percent in PERCENTILES:
+        summary['p{}'.format(percent)] = round(percentile(values, percent), 4)
+    return summary
+
+
+def stage_latencies(trace_path: str) -> dict:
+    """ Collect span durations from exported traces
+
+    :param trace_path: File with traces in OTLP JSON format
+    :return: Dict with span name and latency percentiles in seconds
+    """
+    durations = {}
+    with open(trace_path) as file:
+        for line in file:
+            for resource_spans in ujson.loads(line)['resourceSpans']:
+                for scope_spans in resource_spans['scopeSpans']:
+                    for span in scope_spans['spans']:
+                        duration = (int(span['endTimeUnixNano'])
+                                    - int(span['startTimeUnixNano'])) / 1e9
+                        durations.setdefault(span['name'], []).append(duration)
+
+    return {name: summarize(values) for name, values in sorted(durations.items())}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=PROJECT_PATH,
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def reset_redis(config: dict, keep_cache: bool) -> None:
+    """ Remove queue, jobs and metrics of previous runs
+
+    :param config: Service config
+    :param keep_cache: Keep OCR cache of previous runs
+    :return:
+    """
+    redis = await aioredis.create_redis(
+        'redis://{host}:{port}'.format(**config['redis'])
+    )
+    patterns = [
+        config['queue']['stream'],
+        '{}:*'.format(config['queue']['stream']),
+        '{}:*'.format(config['jobs']['prefix']),
+        '{}:*'.format(config['metrics']['prefix']),
+    ]
+    if not keep_cache:
+        patterns.append('{}:*'.format(config['ocr_cache']['prefix']))
+
+    try:
+        for pattern in patterns:
+            keys = [key async for key in redis.iscan(match=pattern)]
+            if keys:
+                await redis.delete(*keys)
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+
+async def wait_for_server(session: aiohttp.ClientSession, url: str, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(url):
+                return
+        except aiohttp.ClientConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def login(session: aiohttp.ClientSession, base_url: str) -> str:
+    """ Register new user for the run, so results of previous runs are not mixed in
+
+    :param session: Client session
+    :param base_url: API url
+    :return: JWT token
+    """
+    user = {
+        'email': 'bench-{}@example.com'.format(uuid.uuid4().hex[:12]),
+        'password': uuid.uuid4().hex,
+        'name': 'bench',
+        'last_name': 'bench',
+    }
+    async with session.post(base_url + '/api/v1/register', json=user) as response:
+        response.raise_for_status()
+    async with session.post(base_url + '/api/v1/login', json=user) as response:
+        response.raise_for_status()
+        return (await response.json())['token']
+
+
+def create_tasks(scenario: Scenario, images_url: str) -> bytes:
+    lines = []
+    for product in range(scenario.products):
+        lines.append(ujson.dumps({
+            'product_id': scenario.product_id(product),
+            'images_urls': [
+                '{url}/images/{product}/{index}.jpg'.format(
+                    url=images_url, product=product, index=index)
+                for index in range(scenario.images)
+            ],
+            'image_text': scenario.text(product),
+        }))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+async def wait_for_job(session: aiohttp.ClientSession, url: str, headers: dict,
+                       interval: float) -> tuple:
+    """ Poll job until it is finished
+
+    :return: Finished job and timeline of progress
+    """
+    timeline = []
+    started = time.monotonic()
+    while True:
+        async with session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            job = await response.json()
+
+        timeline.append({
+            'elapsed': round(time.monotonic() - started, 3),
+            'done': job['done'],
+            'processing': job['processing'],
+            'queued': job['queued'],
+        })
+        if job['status'] == 'finished':
+            return job, timeline
+        await asyncio.sleep(interval)
+
+
+async def read_results(session: aiohttp.ClientSession, base_url: str, headers: dict) -> list:
+    results = []
+    params = {'limit': 500}
+    while True:
+        async with session.get(base_url + '/api/v1/results', params=params,
+                               headers=headers) as response:
+            response.raise_for_status()
+            page = await response.json()
+        results.extend(page['results'])
+        if not page['next']:
+            return results
+        params['after'] = page['next']
+
+
+def check_accuracy(scenario: Scenario, results: list, images_url: str) -> dict:
+    """ Compare stored results with expected ones
+
+    :param scenario: Benchmark scenario
+    :param results: Results of the run
+    :param images_url: Url of image server
+    :return: Dict with counters
+    """
+    stored = {row['product_id']: row['image_url'] for row in results}
+    counters = {'correct': 0, 'false_negative': 0, 'false_positive': 0, 'wrong_image': 0,
+                'missing': 0, 'expected_failed': 0}
+
+    for product in range(scenario.products):
+        expected, index = scenario.expected(product)
+        url = stored.get(scenario.product_id(product))
+        if expected == 'failed':
+            counters['expected_failed'] += 1
+            counters['correct' if url is None else 'false_positive'] += 1
+        elif url is None:
+            counters['missing'] += 1
+        elif expected == 'matched':
+            target = '{url}/images/{product}/{index}.jpg'.format(
+                url=images_url, product=product, index=index)
+            if url == target:
+                counters['correct'] += 1
+            else:
+                counters['wrong_image' if url.startswith(images_url) else 'false_negative'] += 1
+        else:
+            counters['correct' if not url.startswith(images_url) else 'false_positive'] += 1
+
+    counters['accuracy'] = round(counters['correct'] / scenario.products, 4)
+    return counters
+
+
+def resources(cpu_started: os.times_result, cpu_finished: os.times_result,
+              wall: float) -> dict:
+    """ CPU and memory usage of API process and OCR workers. OCR workers are
+    accounted after they exited, image server is still running and not included.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    api_cpu = (cpu_finished.user + cpu_finished.system
+               - cpu_started.user - cpu_started.system)
+    ocr_cpu = children.ru_utime + children.ru_stime
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+
+    return {
+        'api_cpu_seconds': round(api_cpu, 3),
+        'ocr_cpu_seconds': round(ocr_cpu, 3),
+        'cpu_utilization': round((api_cpu + ocr_cpu) / wall / os.cpu_count(), 4),
+        'api_cpu_utilization': round(api_cpu / wall, 4),
+        'cpus': os.cpu_count(),
+        'api_peak_rss_mb': round(own.ru_maxrss * scale / 2 ** 20, 1),
+        'ocr_worker_peak_rss_mb': round(children.ru_maxrss * scale / 2 ** 20, 1),
+    }
+
+
+async def run(args: argparse.Namespace, scenario: Scenario, trace_path: str) -> dict:
+    config = get_config(args.config)
+    config['tracing'].update(sample_rate=args.trace_rate, export_path=trace_path)
+    await reset_redis(config, args.keep_cache)
+
+    images_url = 'http://{host}:{port}'.format(host=args.host, port=args.images_port)
+    base_url = 'http://{host}:{port}'.format(host=args.host, port=config['app']['port'])
+
+    runner = web.AppRunner(init_app(config), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, config['app']['port']).start()
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_for_server(session, images_url + '/images/0/0.jpg')
+            headers = {'Authorization': await login(session, base_url)}
+
+            cpu_started, started = os.times(), time.monotonic()
+
+            body = create_tasks(scenario, images_url)
+            async with session.post(
+                base_url + '/api/v1/urls/batch', data=body,
+                headers=dict(headers, **{'Content-Type': 'application/x-ndjson'})
+            ) as response:
+                response.raise_for_status()
+                ingest = await response.json()
+            ingested = time.monotonic()
+
+            async with session.get(base_url + '/api/v1/urls/start_processing',
+                                   headers=headers) as response:
+                response.raise_for_status()
+                job_id = (await response.json())['job_id']
+
+            job, timeline = await wait_for_job(
+                session, base_url + '/api/v1/jobs/{}'.format(job_id), headers, args.poll_interval
+            )
+            finished = time.monotonic()
+            cpu_finished = os.times()
+
+            results = await read_results(session, base_url, headers)
+    finally:
+        await runner.cleanup()
+
+    wall = finished - started
+    processing = finished - ingested
+
+    return {
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(),
+        'scenario': vars(scenario),
+        'config': {key: config[key] for key in ('ocr', 'processing', 'http', 'dispatcher')},
+        'ingest': {
+            'seconds': round(ingested - started, 3),
+            'products_per_second': round(scenario.products / max(ingested - started, 1e-6), 1),
+            'response': {key: value for key, value in ingest.items() if key != 'errors'},
+        },
+        'processing': {
+            'seconds': round(processing, 3),
+            'products_per_second': round(scenario.products / processing, 3),
+            'images_per_second_max': round(scenario.products * scenario.images / processing, 3),
+            'job': {key: job[key] for key in ('matched', 'not_matched', 'failed', 'skipped')},
+        },
+        'accuracy': check_accuracy(scenario, results, images_url),
+        'stages': stage_latencies(trace_path),
+        'resources': resources(cpu_started, cpu_finished, wall),
+        'timeline': timeline,
+    }
+
+
+def compare(report: dict, baseline: dict) -> list:
+    """ Describe changes of throughput and stage latencies against baseline run
+
+    :param report: Result of current run
+    :param baseline: Result of previous run
+    :return: Lines of comparison
+    """
+    def change(current, previous):
+        if not previous:
+            return 'n/a'
+        return '{:+.1f}%'.format((current - previous) / previous * 100)
+
+    current = report['processing']['products_per_second']
+    previous = baseline['processing']['products_per_second']
+    lines = ['products/s: {} -> {} ({})'.format(previous, current, change(current, previous))]
+
+    for stage, summary in report['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        for key in ('p50', 'p90'):
+            previous = baseline['stages'][stage][key]
+            lines.append('{} {}: {}s -> {}s ({})'.format(
+                stage, key, previous, summary[key], change(summary[key], previous)))
+    return lines
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='End-to-end pipeline benchmark')
+    parser.add_argument('-c', '--config', default=BENCH_CONFIG_PATH.as_posix(),
+                        help='Service config with local Redis and Postgres')
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--images', type=int, default=4, help='Images per product')
+    parser.add_argument('--width', type=int, default=1200)
+    parser.add_argument('--height', type=int, default=900)
+    parser.add_argument('--match-rate', type=float, default=0.7,
+                        help='Share of products with text on one of images')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of images served with 500 status')
+    parser.add_argument('--latency', type=float, default=0.05, help='Image response latency, s')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Latency jitter, s')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--trace-rate', type=float, default=1.0,
+                        help='Share of traced products used for stage latencies')
+    parser.add_argument('--keep-cache', action='store_true', help='Keep OCR cache of previous run')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--images-port', type=int, default=7101)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('-o', '--output', help='Result file, benchmarks/results/ by default')
+    parser.add_argument('--baseline', help='Result of previous run to compare with')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    scenario = Scenario(
+        products=args.products, images=args.images, width=args.width, height=args.height,
+        match_rate=args.match_rate, error_rate=args.error_rate, latency=args.latency,
+        jitter=args.jitter, seed=args.seed,
+    )
+    with tempfile.NamedTemporaryFile(prefix='bench-traces-', suffix='.ndjson') as traces:
+        # image server is started before event loop of benchmark is created
+        image_server = multiprocessing.Process(
+            target=serve_images, args=(scenario, args.host, args.images_port), daemon=True
+        )
+        image_server.start()
+        try:
+            report = asyncio.run(run(args, scenario, traces.name))
+        finally:
+            image_server.terminate()
+            image_server.join()
+
+    output = Path(args.output) if args.output else RESULTS_PATH / 'pipeline-{}.json'.format(
+        datetime.utcnow().strftime('%Y%m%d-%H%M%S'))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(ujson.dumps(report, indent=2))
+
+    print('products/s: {}, accuracy: {}, cpu: {}, api peak rss: {} MB'.format(
+        report['processing']['products_per_second'], report['accuracy']['accuracy'],
+        report['resources']['cpu_utilization'], report['resources']['api_peak_rss_mb']))
+    for stage, summary in report['stages'].items():
+        print('{:<12} p50={p50}s p90={p90}s p99={p99}s max={max}s'.format(stage, **summary))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            print('\n'.join(compare(report, ujson.load(file))))
+
+    print('Saved to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,13 @@
-import os
+import argparse
 import asyncio
 import csv
+import os
+import time
+from itertools import islice
 from pathlib import Path
 
 import aiohttp
+import ujson
 from aiohttp import TCPConnector
 from dotenv import load_dotenv
 
@@ -13,85 +17,307 @@ ENV_PATH = Path('.') / '.env'
 load_dotenv(dotenv_path=ENV_PATH)
 
 BASE = 'http://0.0.0.0:7000'
-CREATE_TASK_ENDPOINT = '{}/api/v1/urls'.format(BASE)
-LOGIN_ENDPOINT = '{}/api/v1/login'.format(BASE)
-HEADERS = {'Content-Type': 'application/json'}
+CREATE_TASKS_ENDPOINT = '{}/api/v1/urls/batch'
+LOGIN_ENDPOINT = '{}/api/v1/login'
 CSV_PATH = os.getenv("CSV_PATH")
+IMAGE_TEXT = os.getenv("IMAGE_TEXT")
 CREDENTIALS = {'email': os.getenv("EMAIL"), 'password': os.getenv("PASSWORD")}
 
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
 logger = create_logger(__name__)
 
 
-def get_csv_data(csv_path: str) -> list:
-    """ Open and read CSV file and return list of dicts with data.
+class AuthError(Exception):
+    """Server did not return JWT-token for credentials"""
+
+
+class RetryLater(Exception):
+    """Server asked to repeat request later (rate limited or overloaded)"""
+
+    def __init__(self, status: int, delay: float = 0):
+        super().__init__('status {}'.format(status))
+        self.delay = delay
+
+
+def retry_after(response: aiohttp.ClientResponse) -> float:
+    """ Delay requested by server in Retry-After header
+
+    :param response: Server response
+    :return: Delay in seconds, 0 if header is missing or is not a number of seconds
+    """
+    try:
+        return max(float(response.headers.get('Retry-After', 0)), 0)
+    except ValueError:
+        return 0
+
+
+class Auth:
+    """ Holder of JWT-token shared by all uploaders. Token is requested once
+    and refreshed when server responds with 401.
+    """
+
+    def __init__(self, base_url: str, credentials: dict):
+        self.base_url = base_url
+        self.credentials = credentials
+        self.token = None
+        self._lock = asyncio.Lock()
+
+    async def headers(self, session: aiohttp.ClientSession) -> dict:
+        if self.token is None:
+            await self.refresh(session, None)
+        return {'Authorization': self.token}
+
+    async def refresh(self, session: aiohttp.ClientSession, expired_token) -> None:
+        """ Request new token unless other uploader already did it
+
+        :param session: Current client request session
+        :param expired_token: Token that was rejected by server
+        :return:
+        """
+        async with self._lock:
+            if self.token == expired_token:
+                self.token = await get_auth_token(session, self.base_url, self.credentials)
+
+
+class Checkpoint:
+    """ Count of CSV rows that were uploaded, stored in file after every batch.
+    Batches are finished out of order, so only continuous prefix of rows is saved.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self._finished = {}
+
+    def load(self) -> int:
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as file:
+                self.rows = ujson.load(file)['rows']
+        return self.rows
+
+    def finish(self, start: int, count: int) -> None:
+        """ Mark batch as uploaded
+
+        :param start: Number of the first row of batch
+        :param count: Count of rows in batch
+        :return:
+        """
+        self._finished[start] = count
+        while self.rows in self._finished:
+            self.rows += self._finished.pop(self.rows)
+
+        if self.path:
+            tmp_path = '{}.tmp'.format(self.path)
+            with open(tmp_path, 'w') as file:
+                ujson.dump({'rows': self.rows}, file)
+            os.replace(tmp_path, self.path)
+
+
+def read_csv_rows(csv_path: str, skip: int = 0):
+    """ Lazily read CSV file row by row.
 
     :param csv_path: Path to CSV file
-    :return: List with rows of CSV file
+    :param skip: Count of rows to skip
+    :return: Generator of rows of CSV file
     """
     with open(csv_path, "r") as file:
         reader = csv.DictReader(file)
-        data = [dict(row) for row in reader]
-        return data
+        yield from islice(reader, skip, None)
 
 
-def create_tasks(data: list) -> list:
-    """ Function that created list with tasks.
-    Task is a dict with 2 fields:
+def create_task(row: dict, image_text: str) -> dict:
+    """ Function that create task from CSV row.
+    Task is a dict with 3 fields:
     1. product_id -> ID or UPC-code of product on website
     2. images_urls -> list of all images from product on website
+    3. image_text -> text for checking on images
+
+    :param row: Row of CSV file
+    :param image_text: Text for checking on images
+    :return: Task
+    """
+    task_id = row['upc'].replace('"', '')
+    images_urls = row['pictures'].split(', ')
+    return dict(product_id=task_id, images_urls=images_urls, image_text=image_text)
+
+
+def read_batches(csv_path: str, image_text: str, batch_size: int, skip: int = 0):
+    """ Group tasks from CSV file to batches
 
-    :param data: List with rows of CSV file
-    :return: List of tasks
+    :param csv_path: Path to CSV file
+    :param image_text: Text for checking on images
+    :param batch_size: Count of tasks in batch
+    :param skip: Count of rows to skip
+    :return: Generator of (number of the first row, list of tasks) pairs
     """
-    tasks = []
-    for row in data:
-        task_id = row['upc'].replace('"', '')
-        images_urls = row['pictures'].split(', ')
-        tasks.append(dict(product_id=task_id, images_urls=images_urls))
-    return tasks
+    rows = read_csv_rows(csv_path, skip)
+    start = skip
+    while True:
+        batch = [create_task(row, image_text) for row in islice(rows, batch_size)]
+        if not batch:
+            return
+        yield start, batch
+        start += len(batch)
 
 
-async def get_auth_token(session: aiohttp.ClientSession):
+async def get_auth_token(session: aiohttp.ClientSession, base_url: str, credentials: dict):
     """ Function that login user and return JWT-token.
 
     :param session: Current client request session
+    :param base_url: Server url
+    :param credentials: Dict with email and password
     :return: JWT-token
+    :raise RetryLater: If login is rate limited or server is overloaded
     """
-    async with session.post(LOGIN_ENDPOINT, json=CREDENTIALS) as response:
+    async with session.post(LOGIN_ENDPOINT.format(base_url), json=credentials) as response:
         logger.info('Start getting token...')
+        if response.status in RETRY_STATUSES:
+            raise RetryLater(response.status, retry_after(response))
         data = await response.json()
         token = data.get('token')
         if not token:
-            logger.info('Auth error')
-        else:
-            logger.info('Token receive successfully')
+            raise AuthError(data.get('message', 'Auth error'))
+        logger.info('Token receive successfully')
         return token
 
 
-async def push_task(session: aiohttp.ClientSession, task: dict) -> None:
-    """ Function that create push task in queue on server.
+async def push_batch(session: aiohttp.ClientSession, auth: Auth, base_url: str, tasks: list,
+                     retries: int) -> dict:
+    """ Function that push batch of tasks in queue on server.
+    Server errors, rate limited requests (including login) and timeouts are retried
+    with exponential backoff, but not sooner than server asks in Retry-After header.
+
+    :param session: Current client request session
+    :param auth: Auth token holder
+    :param base_url: Server url
+    :param tasks: List of tasks
+    :param retries: Max count of retries
+    :return: Server response
+    """
+    body = ujson.dumps(tasks)
+    for attempt in range(retries + 1):
+        requested_delay = 0
+        try:
+            headers = await auth.headers(session)
+            headers['Content-Type'] = 'application/json'
+            async with session.post(CREATE_TASKS_ENDPOINT.format(base_url), data=body,
+                                    headers=headers) as response:
+                if response.status == 401:
+                    await auth.refresh(session, headers['Authorization'])
+                    continue
+                if response.status not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return await response.json()
+                error = 'status {}'.format(response.status)
+                requested_delay = retry_after(response)
+        except RetryLater as e:
+            error, requested_delay = 'login {}'.format(e), e.delay
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            error = repr(e)
+
+        delay = max(min(2 ** attempt, 60), requested_delay)
+        logger.info('Batch upload failed with {error}, retry in {delay}s'.format(
+            error=error, delay=delay))
+        await asyncio.sleep(delay)
+
+    raise RuntimeError('Batch was not uploaded after {} retries'.format(retries))
 
+
+async def upload(queue: asyncio.Queue, session: aiohttp.ClientSession, auth: Auth,
+                 checkpoint: Checkpoint, stats: dict, args: argparse.Namespace) -> None:
+    """ Uploader that takes batches from queue until it receives None
+
+    :param queue: Queue with batches
     :param session: Current client request session
-    :param task: dict with product_id and images_urls
+    :param auth: Auth token holder
+    :param checkpoint: Checkpoint of uploaded rows
+    :param stats: Dict with upload counters
+    :param args: Command line arguments
     :return:
     """
-    if not HEADERS.get('Authorization'):
-        auth_token = await get_auth_token(session)
-        HEADERS['Authorization'] = auth_token
-    async with session.post(CREATE_TASK_ENDPOINT, json=task, headers=HEADERS) as response:
-        if response.status == 201:
-            logger.info('Task {} created successfully'.format(task['product_id']))
-        else:
-            logger.info('Task {} throw some error'.format(task['product_id']))
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+
+        start, tasks = item
+        result = await push_batch(session, auth, args.base_url, tasks, args.retries)
+        for key in ('queued', 'updated', 'skipped', 'failed'):
+            stats[key] += result.get(key, 0)
+        for error in result.get('errors', []):
+            logger.info('Task {} throw some error: {}'.format(
+                tasks[error['index']]['product_id'], error['errors']))
+
+        stats['rows'] += len(tasks)
+        checkpoint.finish(start, len(tasks))
+
+
+async def report_progress(stats: dict, interval: float) -> None:
+    started = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        elapsed = time.monotonic() - started
+        logger.info('Uploaded {rows} rows ({rate:.1f} rows/s), queued {queued}, '
+                    'skipped {skipped}, failed {failed}'.format(
+                        rate=stats['rows'] / elapsed, **stats))
+
+
+async def main(args: argparse.Namespace):
+    checkpoint = Checkpoint(args.checkpoint)
+    skip = checkpoint.load()
+    if skip:
+        logger.info('Resume from row {}'.format(skip))
+
+    auth = Auth(args.base_url, CREDENTIALS)
+    stats = {'rows': 0, 'queued': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+
+    async with aiohttp.ClientSession(connector=TCPConnector(ssl=False), timeout=timeout) as session:
+        uploaders = [
+            asyncio.ensure_future(upload(queue, session, auth, checkpoint, stats, args))
+            for _ in range(args.concurrency)
+        ]
+        progress = asyncio.ensure_future(report_progress(stats, args.progress_interval))
+        try:
+            for batch in read_batches(args.csv, args.image_text, args.batch_size, skip):
+                # Queue is bounded, so file is read only as fast as batches are uploaded
+                done, _ = await asyncio.wait(
+                    [asyncio.ensure_future(queue.put(batch)), *uploaders],
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                # Uploader can finish only with error before all batches are read
+                for uploader in uploaders:
+                    if uploader in done:
+                        uploader.result()
+
+            for _ in uploaders:
+                await queue.put(None)
+            await asyncio.gather(*uploaders)
+        finally:
+            progress.cancel()
+            for uploader in uploaders:
+                uploader.cancel()
+
+    logger.info('Finished: {rows} rows, queued {queued}, updated {updated}, '
+                'skipped {skipped}, failed {failed}'.format(**stats))
 
 
-async def main(tasks: list):
-    async with aiohttp.ClientSession(connector=TCPConnector(ssl=False)) as session:
-        for task in tasks:
-            await push_task(session, task)
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Upload products from CSV file')
+    parser.add_argument('--csv', default=CSV_PATH, help='Path to CSV file')
+    parser.add_argument('--image-text', default=IMAGE_TEXT, help='Text for checking on images')
+    parser.add_argument('--base-url', default=BASE, help='Server url')
+    parser.add_argument('--batch-size', type=int, default=500, help='Products in one request')
+    parser.add_argument('--concurrency', type=int, default=4, help='Requests sent at once')
+    parser.add_argument('--retries', type=int, default=8, help='Retries of failed request')
+    parser.add_argument('--timeout', type=float, default=120, help='Request timeout, seconds')
+    parser.add_argument('--checkpoint', help='File with count of uploaded rows to resume from')
+    parser.add_argument('--progress-interval', type=float, default=10,
+                        help='Progress report interval, seconds')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    csv_data = get_csv_data(CSV_PATH)
-    tasks = create_tasks(csv_data)
-    asyncio.run(main(tasks))
+    asyncio.run(main(parse_args()))
@@ -1,9 +1,12 @@
 import argparse
 import asyncio
+import os
 
 from aiohttp import web
 
 from api.app import init_app
+from utils.common import get_config, DEFAULT_CONFIG_PATH
+from utils.prefork import run_prefork
 
 try:
     import uvloop
@@ -15,6 +18,10 @@ except ImportError:
 parser = argparse.ArgumentParser(description="Text api project")
 parser.add_argument('--reload', action='store_true', help='Auto reload code on changes')
 parser.add_argument('-c', "--config", help='Path to config file')
+parser.add_argument('-p', '--processes', type=int, default=1,
+                    help='Count of server processes sharing one listening socket. '
+                         'OCR workers (ocr.processes, all CPU cores by default) '
+                         'are split between them')
 
 args = parser.parse_args()
 
@@ -30,6 +37,20 @@ def main():
     Entry point for project. Run application on host and port from config
     :return:
     """
+    if args.processes > 1:
+        config = get_config(args.config or ['-c', DEFAULT_CONFIG_PATH.as_posix()])
+        # every child runs its own OCR pool, so all children together use configured count
+        ocr_processes = config['ocr']['processes'] or os.cpu_count()
+        config['ocr'] = dict(config['ocr'],
+                             processes=max(ocr_processes // args.processes, 1))
+        run_prefork(
+            lambda: init_app(config),
+            host=config['app']['host'],
+            port=config['app']['port'],
+            processes=args.processes
+        )
+        return
+
     app = init_app(args.config)
     config = app['config']['app']
 
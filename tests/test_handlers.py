@@ -0,0 +1,79 @@
+import pytest
+from aiohttp import web
+
+from api.handlers import post_urls_for_recognition
+
+
+class FakeQueue:
+
+    def __init__(self):
+        self.tasks = {}
+
+    async def enqueue(self, key: str, data: dict) -> bool:
+        self.tasks[key] = data
+        return True
+
+
+class FakeProcessed:
+
+    async def contains(self, user_id: int, product_id: str) -> bool:
+        return False
+
+
+@web.middleware
+async def fake_auth(request: web.Request, handler):
+    request['user'] = {'id': 1}
+    return await handler(request)
+
+
+@pytest.fixture
+async def client(aiohttp_client):
+    app = web.Application(middlewares=[fake_auth])
+    app['queue'] = FakeQueue()
+    app['processed'] = FakeProcessed()
+    app.router.add_post('/api/v1/urls', post_urls_for_recognition)
+    return await aiohttp_client(app)
+
+
+PRODUCT = {
+    'product_id': '42',
+    'images_urls': ['http://example.com/1.jpg'],
+    'image_text': 'SALE',
+}
+
+
+async def test_post_urls_queues_valid_product(client):
+    response = await client.post('/api/v1/urls', json=PRODUCT)
+
+    assert response.status == 201
+    task = client.app['queue'].tasks['1:42']
+    assert task['image_text'] == 'SALE'
+    assert task['phrases'] is None
+
+
+async def test_post_urls_queues_extra_phrases(client):
+    response = await client.post('/api/v1/urls', json=dict(
+        PRODUCT, phrases=['SALE', 'NEW'], match={'mode': 'fuzzy'}))
+
+    assert response.status == 201
+    task = client.app['queue'].tasks['1:42']
+    assert task['phrases'] == ['SALE', 'NEW']
+    assert task['match'] == {'mode': 'fuzzy'}
+
+
+@pytest.mark.parametrize('field', ['product_id', 'images_urls', 'image_text'])
+async def test_post_urls_requires_fields(client, field):
+    data = {key: value for key, value in PRODUCT.items() if key != field}
+
+    response = await client.post('/api/v1/urls', json=data)
+
+    assert response.status == 400
+    assert field in (await response.json())['errors']
+    assert not client.app['queue'].tasks
+
+
+async def test_post_urls_rejects_invalid_match_mode(client):
+    response = await client.post('/api/v1/urls', json=dict(PRODUCT, match={'mode': 'regex'}))
+
+    assert response.status == 400
+    assert 'match' in (await response.json())['errors']
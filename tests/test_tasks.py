@@ -0,0 +1,35 @@
+import pytest
+
+from api import tasks
+from api.matching import Matcher
+
+
+@pytest.fixture
+def fake_images(monkeypatch):
+    """ Replace download and recognition of image with text by url, 'fail' raises """
+
+    async def check_image_url(executor, cache, session, semaphore, url, matcher, settings,
+                              texts, progress):
+        if url == 'fail':
+            raise RuntimeError('Image failed')
+        return matcher.match(url)
+
+    monkeypatch.setattr(tasks, 'check_image_url', check_image_url)
+
+
+async def load(urls: list, phrases: list) -> list:
+    return await tasks.load_image_content(None, None, None, urls, Matcher(phrases), {}, {},
+                                          concurrency=4, progress=None)
+
+
+async def test_failed_image_after_primary_match_does_not_fail_product(fake_images):
+    assert await load(['MATCH', 'fail'], ['MATCH', 'OTHER']) == ['MATCH', None]
+
+
+async def test_secondary_phrase_is_found_after_failed_image(fake_images):
+    assert await load(['MATCH', 'fail', 'OTHER'], ['MATCH', 'OTHER']) == ['MATCH', 'OTHER']
+
+
+async def test_failed_image_before_primary_match_fails_product(fake_images):
+    with pytest.raises(RuntimeError):
+        await load(['fail', 'MATCH'], ['MATCH', 'OTHER'])
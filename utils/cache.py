@@ -0,0 +1,64 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """ Bounded in-process cache with least recently used eviction
+    and optional expiration of entries.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Get value by key and mark it as recently used
+
+        :param key: Cache key
+        :param default: Value returned if key is missing or expired
+        :return: Cached value
+        """
+        try:
+            value, expires_at = self._data[key]
+        except KeyError:
+            return default
+
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """ Set value and evict least recently used entries over the size limit
+
+        :param key: Cache key
+        :param value: Value
+        :return:
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """ Remove key from cache
+
+        :param key: Cache key
+        :param default: Value returned if key is missing
+        :return: Removed value
+        """
+        value, _ = self._data.pop(key, (default, None))
+        return value
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -6,17 +6,83 @@ from typing import Any
 import trafaret as T
 from aiohttp import web
 from trafaret_config import commandline
+import yaml
 
 PROJECT_PATH = Path(__file__).parent.parent
 DEFAULT_CONFIG_FILE = os.environ.get('CONFIG_FILE', 'dev.yml')
 DEFAULT_CONFIG_PATH = PROJECT_PATH / 'config' / DEFAULT_CONFIG_FILE
 
+
+def check_region(region: list) -> Any:
+    """
+    Check that region of interest is not empty
+    :param region: [left, top, right, bottom] fractions
+    :return: Region or DataError
+    """
+    left, top, right, bottom = region
+    if left >= right or top >= bottom:
+        return T.DataError('left must be less than right and top less than bottom')
+    return region
+
+
 TRAFARET = T.Dict({
     T.Key('app'):
         T.Dict({
             'host': T.String(),
             'port': T.Int(),
-            'workers': T.Int(),
+        }),
+    T.Key('ocr'):
+        T.Dict({
+            'processes': T.Int(gte=0),
+            'lang': T.String(),
+            'psm': T.Int(gte=0, lte=13),
+            'oem': T.Int(gte=0, lte=3),
+            'dpi': T.Int(gte=0),
+            'whitelist': T.String(allow_blank=True),
+            'profile': T.String(allow_blank=True),
+        }),
+    T.Key('preprocess'):
+        T.Dict({
+            'max_side': T.Int(gte=0),
+            'draft': T.Bool(),
+            'grayscale': T.Bool(),
+            'binarize': T.Bool(),
+            'block_size': T.Int(gte=3),
+            'offset': T.Int(gte=0, lte=255),
+            'regions': T.List(
+                T.List(T.Float(gte=0, lte=1), min_length=4, max_length=4) & T.Call(check_region)
+            ),
+        }),
+    T.Key('texts'):
+        T.Dict({
+            'enabled': T.Bool(),
+            'all_images': T.Bool(),
+            'words': T.Bool(),
+        }),
+    T.Key('matching'):
+        T.Dict({
+            'mode': T.Enum('exact', 'normalized', 'fuzzy'),
+            'max_distance': T.Int(gte=0),
+        }),
+    T.Key('ocr_cache'):
+        T.Dict({
+            'prefix': T.String(),
+            'local_size': T.Int(gte=0),
+            'ttl': T.Int(gt=0),
+            'max_entries': T.Int(gt=0),
+        }),
+    T.Key('processing'):
+        T.Dict({
+            'images_concurrency': T.Int(gte=1),
+        }),
+    T.Key('http'):
+        T.Dict({
+            'limit': T.Int(gte=0),
+            'limit_per_host': T.Int(gte=0),
+            'dns_cache_ttl': T.Int(),
+            'keepalive_timeout': T.Float(),
+            'total_timeout': T.Float(),
+            'connect_timeout': T.Float(),
         }),
     T.Key('postgres'):
         T.Dict({
@@ -30,6 +96,91 @@ TRAFARET = T.Dict({
         T.Dict({
             'port': T.Int(),
             'host': T.String(),
+            'min_size': T.Int(gte=1),
+            'max_size': T.Int(gte=1),
+        }),
+    T.Key('queue'):
+        T.Dict({
+            'stream': T.String(),
+            'group': T.String(),
+            'claim_idle_ms': T.Int(),
+            'batch_size': T.Int(),
+        }),
+    T.Key('jobs'):
+        T.Dict({
+            'prefix': T.String(),
+            'ttl': T.Int(gt=0),
+            'flush_interval': T.Float(gt=0),
+        }),
+    T.Key('dispatcher'):
+        T.Dict({
+            'enabled': T.Bool(),
+            'concurrency': T.Int(gt=0),
+            'pending_limit': T.Int(gte=0),
+            'poll_interval': T.Float(gt=0),
+            'drain_timeout': T.Float(gte=0),
+        }),
+    T.Key('processed'):
+        T.Dict({
+            'prefix': T.String(),
+            'rebuild_batch': T.Int(gt=0),
+            'rebuild_lock_ttl': T.Int(gt=0),
+        }),
+    T.Key('writer'):
+        T.Dict({
+            'batch_size': T.Int(gt=0),
+            'flush_interval': T.Float(gt=0),
+        }),
+    T.Key('batch'):
+        T.Dict({
+            'enqueue_batch': T.Int(gt=0),
+            'max_body_size': T.Int(gt=0),
+            'max_errors': T.Int(gte=0),
+        }),
+    T.Key('results'):
+        T.Dict({
+            'default_limit': T.Int(gt=0),
+            'max_limit': T.Int(gt=0),
+            'count_ttl': T.Int(gt=0),
+            'export_chunk_size': T.Int(gt=0),
+        }),
+    T.Key('metrics'):
+        T.Dict({
+            'prefix': T.String(),
+            'flush_interval': T.Float(gt=0),
+        }),
+    T.Key('tracing'):
+        T.Dict({
+            'sample_rate': T.Float(gte=0, lte=1),
+            'export_path': T.String(allow_blank=True),
+            'slow_threshold': T.Float(gt=0),
+        }),
+    T.Key('profiling'):
+        T.Dict({
+            'enabled': T.Bool(),
+            'max_seconds': T.Int(gt=0),
+            'admins': T.List(T.String()),
+        }),
+    T.Key('users'):
+        T.Dict({
+            'cache_size': T.Int(gt=0),
+            'cache_ttl': T.Float(gt=0),
+            'channel': T.String(),
+        }),
+    T.Key('passwords'):
+        T.Dict({
+            'method': T.Enum('pbkdf2:sha256', 'pbkdf2:sha512'),
+            'iterations': T.Int(gt=0),
+            'salt_length': T.Int(gte=8),
+            'workers': T.Int(gt=0),
+            'queue_size': T.Int(gte=0),
+        }),
+    T.Key('login_limit'):
+        T.Dict({
+            'prefix': T.String(),
+            'window': T.Int(gt=0),
+            'per_email': T.Int(gte=0),
+            'per_address': T.Int(gte=0),
         }),
     T.Key('jwt_auth'):
         T.Dict({
@@ -60,14 +211,39 @@ def get_config(argv: Any = None) -> Any:
         options, unknown = ap.parse_known_args(argv)
 
     config = commandline.config_from_options(options, TRAFARET)
-    return config
+    return load_profile(config)
 
 
-def init_config(app: web.Application, config: str) -> None:
+def load_profile(config: dict) -> dict:
+    """
+    Override settings with tuned profile from ``ocr.profile`` path,
+    e.g. made by benchmarks/ocr.py. Profile is YML-file with sections of config.
+    :param config: Config dict
+    :return: Config dict with profile settings
+    """
+    path = config['ocr']['profile']
+    if not path:
+        return config
+
+    with open(path) as file:
+        profile = yaml.safe_load(file) or {}
+
+    merged = dict(config)
+    for section, settings in profile.items():
+        merged[section] = dict(config.get(section, {}), **settings)
+
+    return TRAFARET.check(merged)
+
+
+def init_config(app: web.Application, config: Any) -> None:
     """
     Initialize config file for application
     :param app: Current App object
-    :param config: Path to config file
+    :param config: Path to config file or already loaded config dict
     :return:
     """
+    if isinstance(config, dict):
+        app['config'] = config
+        return
+
     app['config'] = get_config(config or ['-c', DEFAULT_CONFIG_PATH.as_posix()])
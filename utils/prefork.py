@@ -0,0 +1,108 @@
+import os
+import signal
+import socket
+import time
+from typing import Callable
+
+from aiohttp import web
+
+from utils.logging import create_logger
+
+logger = create_logger(__name__)
+
+# Child that exits sooner after start is restarted with delay to avoid busy restart loop
+MIN_CHILD_LIFETIME = 1.0
+
+
+def create_socket(host: str, port: int) -> socket.socket:
+    """ Create listening socket shared by all child processes
+
+    :param host: Host
+    :param port: Port
+    :return: Bound socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+def run_child(app_factory: Callable[[], web.Application], sock: socket.socket) -> None:
+    """ Run application on inherited socket in forked process. Application
+    connections are created and closed by its own startup and cleanup signals.
+
+    :param app_factory: Function that creates application
+    :param sock: Listening socket
+    :return:
+    """
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+
+    exit_code = 0
+    try:
+        web.run_app(app_factory(), sock=sock, print=None)
+    except Exception:
+        logger.exception('Worker {pid} failed'.format(pid=os.getpid()))
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
+
+
+def run_prefork(app_factory: Callable[[], web.Application], host: str, port: int,
+                processes: int) -> None:
+    """ Serve application by ``processes`` forked children that accept connections
+    from one pre-bound socket. Children that exit are restarted, SIGTERM and SIGINT
+    are forwarded to children and parent exits when all of them are finished.
+
+    :param app_factory: Function that creates application, called in every child
+    :param host: Host
+    :param port: Port
+    :param processes: Count of child processes
+    :return:
+    """
+    sock = create_socket(host, port)
+    children = {}
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            run_child(app_factory, sock)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(processes):
+        spawn()
+    logger.info('Serving on http://{host}:{port} with {count} processes'.format(
+        host=host, port=port, count=processes))
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        started_at = children.pop(pid, None)
+        if stopping or started_at is None:
+            continue
+
+        logger.info('Worker {pid} exited with status {status}, restart it'.format(
+            pid=pid, status=status))
+        if time.monotonic() - started_at < MIN_CHILD_LIFETIME:
+            time.sleep(MIN_CHILD_LIFETIME)
+        spawn()
+
+    sock.close()
@@ -0,0 +1,68 @@
+import asyncio
+import cProfile
+import io
+import pstats
+
+from aiohttp import web
+
+try:
+    import yappi
+except ImportError:
+    yappi = None
+
+
+async def profile(seconds: float, threads: bool = False, limit: int = 100) -> str:
+    """ Profile running process for some seconds. yappi is used if installed,
+    it also profiles all threads, otherwise only event loop thread is profiled with cProfile.
+
+    :param seconds: Profiling duration
+    :param threads: Profile all threads, requires yappi
+    :param limit: Count of functions in report
+    :return: Report sorted by cumulative time
+    """
+    if yappi is not None:
+        return await _profile_yappi(seconds, threads, limit)
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+
+async def _profile_yappi(seconds: float, threads: bool, limit: int) -> str:
+    yappi.clear_stats()
+    yappi.set_clock_type('wall')
+    yappi.start(builtins=False, profile_threads=threads)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        yappi.stop()
+
+    stream = io.StringIO()
+    stats = yappi.get_func_stats()
+    stats.sort('ttot', 'desc')
+    stats.print_all(out=stream, columns={
+        0: ('name', 80), 1: ('ncall', 10), 2: ('tsub', 10), 3: ('ttot', 10), 4: ('tavg', 10)
+    })
+    if threads:
+        yappi.get_thread_stats().print_all(out=stream)
+    yappi.clear_stats()
+
+    return '\n'.join(stream.getvalue().splitlines()[:limit + 10])
+
+
+async def init_profiling(app: web.Application) -> web.Application:
+    """ Initialize lock of profiling, only one profiling runs in process at once
+
+    :param app: Web application
+    :return: Web application
+    """
+    app['profiling_lock'] = asyncio.Lock()
+
+    return app